@@ -1,23 +1,88 @@
+import uuid
 from decimal import Decimal
 
 from celery.app import Celery
 from celery.signals import worker_process_init
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import BatchStatement, BatchType, SimpleStatement
 
-from .celery_utils import format_gallop_timestamp, format_timestring, or_else
+from . import change_log, ranking_generation, rollup
+from .celery_utils import TIME_INPUT_FORMAT, parse_timestring, to_decimal
+from .data_point_writer import BATCH_STEP, DataPointWriter
 from .mnemonic.response_types import (
     MnemonicOwnersSeries,
     MnemonicPriceSeries,
     MnemonicSalesVolumeSeries,
     MnemonicTokensSeries,
 )
+from .transform import select_floors
 
 from etl.config import BROKER_URL, CELERY_APP_NAME, REDIS_URL
-from etl.database import CassandraDb, PostgresSearchDb
-
-BATCH_STEP = 30
+from etl import jobs
+from etl.database import CassandraDb, PostgresSearchDb, RedisDb
+from etl.serialization import configure_serialization
+from etl.task_routing import configure_routing
 
 worker_process_init.connect(CassandraDb.c_init)
 app = Celery(CELERY_APP_NAME, broker=BROKER_URL, backend=REDIS_URL)
+configure_serialization(app)
+configure_routing(app)
+
+CassandraDb.register_statement(
+    "collection.upsert",
+    "collection",
+    """
+    UPDATE collection
+    SET image = ?,
+        banner_image = ?,
+        owners = ?,
+        tokens = ?,
+        name = ?,
+        description = ?,
+        external_url = ?,
+        sales_volume = ?,
+        type = ?
+    WHERE address = ?
+    """,
+)
+CassandraDb.register_statement(
+    "collection.update_floor",
+    "collection",
+    """
+    UPDATE collection
+    SET floor = ?
+    WHERE address = ?
+    """,
+)
+CassandraDb.register_statement(
+    "collection.select",
+    "collection",
+    """
+    SELECT address, name, type, tokens, owners, sales_volume, image, banner_image,
+        description, external_url, floor
+    FROM collection
+    WHERE address = ?
+    """,
+)
+CassandraDb.register_statement(
+    "ranking.select_partition",
+    "ranking",
+    """
+    SELECT duration, rank, collection, value
+    FROM ranking
+    WHERE rank = ?
+      AND duration = ?
+      AND generation = ?
+    """,
+)
+CassandraDb.register_statement(
+    "ranking.insert",
+    "ranking",
+    """
+    INSERT INTO ranking (rank, duration, generation, collection, value)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+)
 
 ###############################################################################
 """
@@ -39,21 +104,7 @@ def upsert_collection(
     type: str = None,
 ):
     session = CassandraDb.get_db_session()
-    q = session.prepare(
-        f"""
-        UPDATE collection
-        SET image = ?,
-            banner_image = ?,
-            owners = ?,
-            tokens = ?,
-            name = ?,
-            description = ?,
-            external_url = ?,
-            sales_volume = ?,
-            type = ?
-        WHERE address = ?
-        """
-    )
+    q = CassandraDb.get_statement("collection.upsert")
 
     try:
         session.execute(
@@ -71,6 +122,7 @@ def upsert_collection(
                 contract_address,
             ],
         )
+        change_log.record_collections([contract_address])
         return {
             "operation": f"collection/upsert/{contract_address}",
             "status": "success",
@@ -90,45 +142,49 @@ RANKINGS
 
 
 @app.task(name="get_rankings")
-def get_rankings():
+def get_rankings(rank: str = "avg_price", duration: str = "DURATION_1_DAY"):
+    """
+    Returns the active generation's leaderboard, from the highest value down.
+    """
     session = CassandraDb.get_db_session()
-
-    res = session.execute(
-        """
-        SELECT *
-        FROM ranking
-        WHERE rank = 'avg_price'
-          AND duration = 'DURATION_1_DAY';
-        """
+    generation = ranking_generation.get_active_generation()
+    if generation is None:
+        return []
+    rows = session.execute(
+        CassandraDb.get_statement("ranking.select_partition"),
+        [rank, duration, generation],
     )
-
-    for row in res:
-        # row: {
-        #   'collection' : '', # row.collection
-        #   'duration': '',
-        #   'rank': '',
-        #   'value': Decimal()
-        # }
-        pass
+    return [
+        {"contract_address": row.collection, "value": str(row.value)}
+        for row in sorted(rows, key=lambda row: row.value, reverse=True)
+    ]
 
 
 @app.task(name="create_ranking")
 def create_ranking(
     contract_address: str, metric_value: str, rank_type: str, rank_duration: str
 ):
+    """
+    Adds a collection to the active generation's ranking.
+    """
     session = CassandraDb.get_db_session()
 
-    statement = session.prepare(
-        """
-        INSERT INTO ranking (rank, duration, collection, value)
-            VALUES (?, ?, ?, ?)
-        """
-    )
+    statement = CassandraDb.get_statement("ranking.insert")
     try:
+        generation = ranking_generation.get_active_generation()
+        if generation is None:
+            raise LookupError("No ranking generation is active")
         session.execute(
             statement,
-            [rank_type, rank_duration, contract_address, Decimal(value=metric_value)],
+            [
+                rank_type,
+                rank_duration,
+                generation,
+                contract_address,
+                Decimal(value=metric_value),
+            ],
         )
+        change_log.record_ranking(rank_type, rank_duration)
         return {
             "operation": f"rank/{rank_type}/{rank_duration}/{contract_address}",
             "status": "success",
@@ -146,36 +202,126 @@ def create_rankings(
     rankings,
     rank_metric,
     duration,
+    generation: str = None,
 ):
+    """
+    Writes a page of a leaderboard into `generation`, activating the generation if this was
+    its last page to be written. Without a generation, the page is added to the active one,
+    and nothing is written if none is active.
+    """
     session = CassandraDb.get_db_session()
-    statements = []
-    if not len(rankings):
-        return {"message": f"{rank_metric}/{duration}/empty"}
-    for rank in rankings:
-        statements.append(
-            f"""
-            INSERT INTO ranking (rank, duration, collection, value)
-            VALUES ('{rank_metric}', '{duration}', '{rank['contract_address']}', {rank['value']})
-            """
-        )
+    statement = CassandraDb.get_statement("ranking.insert")
+    sealed = generation is not None
+    if not sealed:
+        generation = ranking_generation.get_active_generation()
+        if generation is None:
+            return {
+                "operation": f"{rank_metric}/{duration}",
+                "status": "failed",
+                "message": "No ranking generation is active",
+            }
 
     errors = []
-    for i in range(0, len(statements), BATCH_STEP):
-        try:
-            session.execute(
-                "BEGIN BATCH\n"
-                + "\n".join(statements[i : i + BATCH_STEP])
-                + "\nAPPLY BATCH"
-            )
-            # time.sleep(CASSANDRA_BATCH_DELAY)
-        except Exception as e:
-            errors.append(e.__str__())
+    try:
+        if len(rankings):
+            ranking_generation.record_partition(generation, rank_metric, duration)
+
+        # Every row of a page is in the same partition, so each batch is applied as one write.
+        for i in range(0, len(rankings), BATCH_STEP):
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for rank in rankings[i : i + BATCH_STEP]:
+                batch.add(
+                    statement,
+                    [
+                        rank_metric,
+                        duration,
+                        generation,
+                        rank["contract_address"],
+                        to_decimal(rank["value"]),
+                    ],
+                )
+            try:
+                session.execute(batch)
+            except Exception as e:
+                errors.append(e.__str__())
+    except Exception as e:
+        errors.append(e.__str__())
+
+    if not sealed:
+        change_log.record_ranking(rank_metric, duration)
+    elif ranking_generation.page_done(generation, failed=bool(errors)):
+        activate_ranking_generation.delay(generation)
+
+    if not len(rankings):
+        return {"status": "skipped", "message": f"{rank_metric}/{duration}/empty"}
     return {
-        "operation": f"{rank_metric}/{duration}",
+        "operation": f"{rank_metric}/{duration}/{generation}",
         "status": "success" if not errors else errors,
     }
 
 
+@app.task(name="seal_ranking_generation")
+def seal_ranking_generation(generation: str, page_count: int):
+    """
+    Marks a generation as sent in `page_count` pages, activating it if all were written.
+    """
+    if ranking_generation.seal(generation, page_count):
+        activate_ranking_generation.delay(generation)
+    return {
+        "operation": f"ranking/generation/{generation}/seal",
+        "status": "success",
+        "pages": page_count,
+    }
+
+
+@app.task(name="activate_ranking_generation")
+def activate_ranking_generation(generation: str):
+    """
+    Switches readers to a fully written generation, then deletes generations older than
+    the one it replaced. Generations with failed pages are never activated.
+    """
+    operation = f"ranking/generation/{generation}/activate"
+    try:
+        failures = ranking_generation.get_failures(generation)
+        if failures:
+            raise RuntimeError(f"{failures} pages failed to be written")
+        partitions = ranking_generation.get_partitions(generation)
+        if not partitions:
+            raise RuntimeError("No rankings were written")
+
+        previous = ranking_generation.get_active_generation()
+        if previous is not None and previous > generation:
+            raise RuntimeError(f"A newer generation {previous} is already active")
+        ranking_generation.activate(generation)
+
+        # Partitions of either generation differ in the search index.
+        if previous is not None:
+            partitions = set(partitions).union(
+                ranking_generation.get_partitions(previous)
+            )
+        for rank, duration in partitions:
+            change_log.record_ranking(rank, duration)
+        migrate_changes.delay()
+        if previous is not None:
+            ranking_generation.invalidate_leaderboards(previous)
+
+        collected = ranking_generation.collect_garbage(
+            keep={generation, previous}, before=generation
+        )
+        return {
+            "operation": operation,
+            "status": "success",
+            "previous": previous,
+            "collected": collected,
+        }
+    except Exception as e:
+        return {
+            "operation": operation,
+            "status": "failed",
+            "message": e.__str__(),
+        }
+
+
 @app.task(name="delete_rankings")
 def delete_rankings():
     session = CassandraDb.get_db_session()
@@ -197,251 +343,211 @@ DATAPOINTS
 """
 
 
-@app.task(name="update_prices")
-def update_prices(contract_address: str, prices: MnemonicPriceSeries):
+def write_series(contract_address: str, series_name: str, series):
     """
-    While this may be vulnerable to CQL injection,
-    it is a temporary workaround to avoid the rate limits on the database.
+    Writes one Mnemonic series into the collection's `data_point` partition.
     """
-    session = CassandraDb.get_db_session()
-
-    statement = []
-    if not len(prices["dataPoints"]):
-        return {"message": f"{contract_address}/owners/empty"}
-    for point in prices["dataPoints"]:
-        statement.append(
-            f"""
-            UPDATE data_point
-               SET min_price = {or_else(point['min'])},
-                   max_price = {or_else(point['max'])},
-                   average_price = {or_else(point['avg'])}
-            WHERE collection = '{contract_address}'
-            AND time_stamp = '{format_timestring(point['timestamp'])}';
-            """
-        )
+    if not len(series["dataPoints"]):
+        return {
+            "status": "skipped",
+            "message": f"{contract_address}/{series_name}/empty",
+        }
 
-    errors = []
-    for i in range(0, len(statement), BATCH_STEP):
-        try:
-            session.execute(
-                "BEGIN BATCH"
-                + "\n".join(statement[i : i + BATCH_STEP])
-                + "\nAPPLY BATCH"
-            )
-            # time.sleep(CASSANDRA_BATCH_DELAY) # Time delay for Cosmo
-        except Exception as e:
-            errors.append(e.__str__())
+    writer = DataPointWriter(CassandraDb.get_db_session(), contract_address)
+    writer.add_series(series_name, series["dataPoints"])
+    earliest, _ = writer.get_time_span()
+    report = writer.flush()
+    if any("errors" not in batch for batch in report["batches"]):
+        update_rollups.delay(contract_address, earliest.strftime(TIME_INPUT_FORMAT))
 
     return {
-        "operation": f"prices/{contract_address}",
-        "status": "success" if not errors else ",\n".join(errors),
+        "operation": f"{series_name}/{contract_address}",
+        "status": "success" if not report["errors"] else ",\n".join(report["errors"]),
+        "batches": report["batches"],
     }
 
 
-@app.task(name="update_sales")
-def update_sales(contract_address: str, sales: MnemonicSalesVolumeSeries):
-    session = CassandraDb.get_db_session()
-
-    statement = []
-    if not len(sales["dataPoints"]):
-        return {"message": f"{contract_address}/owners/empty"}
-    for point in sales["dataPoints"]:
-        statement.append(
-            f"""
-            UPDATE data_point
-               SET sales_count = {or_else(point['quantity'])},
-                   sales_volume = {or_else(point['volume'])}
-            WHERE collection = '{contract_address}'
-            AND time_stamp = '{format_timestring(point['timestamp'])}';
-            """
-        )
+@app.task(name="update_prices")
+def update_prices(contract_address: str, prices: MnemonicPriceSeries):
+    return write_series(contract_address, "prices", prices)
 
-    errors = []
-    for i in range(0, len(statement), BATCH_STEP):
-        try:
-            session.execute(
-                "BEGIN BATCH"
-                + "\n".join(statement[i : i + BATCH_STEP])
-                + "\nAPPLY BATCH"
-            )
-            # time.sleep(CASSANDRA_BATCH_DELAY) # Time delay for Cosmo
-        except Exception as e:
-            errors.append(e.__str__())
 
-    return {
-        "operation": f"sales/{contract_address}",
-        "status": "success" if not errors else ",\n".join(errors),
-    }
+@app.task(name="update_sales")
+def update_sales(contract_address: str, sales: MnemonicSalesVolumeSeries):
+    return write_series(contract_address, "sales", sales)
 
 
 @app.task(name="update_tokens")
 def update_tokens(contract_address: str, tokens: MnemonicTokensSeries):
-    session = CassandraDb.get_db_session()
-
-    statement = []
-    if not len(tokens["dataPoints"]):
-        return {"message": f"{contract_address}/tokens/empty"}
-    for point in tokens["dataPoints"]:
-        statement.append(
-            f"""
-            UPDATE data_point
-               SET tokens_minted = {or_else(point['minted'])},
-                   tokens_burned = {or_else(point['burned'])},
-                   total_minted = {or_else(point['totalMinted'])},
-                   total_burned = {or_else(point['totalBurned'])}
-            WHERE collection = '{contract_address}'
-            AND time_stamp = '{format_timestring(point['timestamp'])}';
-            """
-        )
-
-    errors = []
-    for i in range(0, len(statement), BATCH_STEP):
-        try:
-            session.execute(
-                "BEGIN BATCH"
-                + "\n".join(statement[i : i + BATCH_STEP])
-                + "\nAPPLY BATCH"
-            )
-            # time.sleep(CASSANDRA_BATCH_DELAY) # Time delay for Cosmo
-        except Exception as e:
-            errors.append(e.__str__())
-
-    return {
-        "operation": f"tokens/{contract_address}",
-        "status": "success" if not errors else ",\n".join(errors),
-    }
+    return write_series(contract_address, "tokens", tokens)
 
 
 @app.task(name="update_owners")
 def update_owners(contract_address: str, owners: MnemonicOwnersSeries):
-    session = CassandraDb.get_db_session()
-
-    statement = []
-    if not len(owners["dataPoints"]):
-        return {"message": f"{contract_address}/owners/empty"}
-    for point in owners["dataPoints"]:
-        statement.append(
-            f"""
-            UPDATE data_point
-               SET owners_count = {or_else(point['count'])}
-            WHERE collection = '{contract_address}'
-            AND time_stamp = '{format_timestring(point['timestamp'])}';
-            """
-        )
+    return write_series(contract_address, "owners", owners)
 
-    errors = []
-    for i in range(0, len(statement), BATCH_STEP):
-        try:
-            session.execute(
-                "BEGIN BATCH"
-                + "\n".join(statement[i : i + BATCH_STEP])
-                + "\nAPPLY BATCH"
-            )
-            # time.sleep(CASSANDRA_BATCH_DELAY) # Time delay for Cosmo
-        except Exception as e:
-            errors.append(e.__str__())
 
-    return {
-        "operation": f"owners/{contract_address}",
-        "status": "success" if not errors else ",\n".join(errors),
+@app.task(name="upsert_data_points")
+def upsert_data_points(
+    contract_address: str,
+    prices: MnemonicPriceSeries,
+    sales: MnemonicSalesVolumeSeries,
+    tokens: MnemonicTokensSeries,
+    owners: MnemonicOwnersSeries,
+):
+    """
+    Writes all four Mnemonic series of a collection, joined on timestamp,
+    so that each `data_point` row is updated once.
+    """
+    series_points = {
+        "prices": prices["dataPoints"],
+        "sales": sales["dataPoints"],
+        "tokens": tokens["dataPoints"],
+        "owners": owners["dataPoints"],
     }
+    if not any(len(data_points) for data_points in series_points.values()):
+        return {
+            "status": "skipped",
+            "message": f"{contract_address}/data_points/empty",
+        }
 
+    writer = DataPointWriter(CassandraDb.get_db_session(), contract_address)
+    missing = writer.add_joined_series(series_points)
+    rows = len(writer.rows)
+    earliest, _ = writer.get_time_span()
+    report = writer.flush()
+    if any("errors" not in batch for batch in report["batches"]):
+        update_rollups.delay(contract_address, earliest.strftime(TIME_INPUT_FORMAT))
 
-###############################################################################
-"""
-COLLECTIONS.FLOOR
-"""
-
-
-@app.task(name="update_floor")
-def update_floor(floor_prices=[]):
-    session = CassandraDb.get_db_session()
-    statement = []
-    for floor_price_listing in floor_prices:
-        contract_address = floor_price_listing["collection_address"]
+    return {
+        "operation": f"data_points/{contract_address}",
+        "status": "success" if not report["errors"] else ",\n".join(report["errors"]),
+        "rows": rows,
+        "reconciliation": {
+            series: {"missing": len(timestamps), "timestamps": timestamps}
+            for series, timestamps in missing.items()
+            if timestamps
+        },
+        "batches": report["batches"],
+    }
 
-        latest_updated_at = format_gallop_timestamp(
-            floor_price_listing["marketplaces"][0]["updated_at"],
-        )
-        min_floor = or_else(
-            floor_price_listing["marketplaces"][0]["floor_price"], default_value=0
-        )
-        for i in range(1, len(floor_price_listing["marketplaces"])):
-            new_listing = floor_price_listing["marketplaces"][i]
-            new_timestamp = format_gallop_timestamp(
-                new_listing["updated_at"],
-            )
-            new_floor = or_else(new_listing["floor_price"], default_value=0)
-            if not new_floor:
-                pass
-            elif (new_timestamp > latest_updated_at) or (new_floor and not min_floor):
-                min_floor = new_floor
-
-        statement.append(
-            f"""
-            UPDATE collection
-               SET floor = {min_floor}
-            WHERE address = '{contract_address}';
-            """
-        )
 
+@app.task(name="update_rollups")
+def update_rollups(contract_address: str, earliest_written: str):
+    """
+    Recomputes the collection's windowed rollups touched by newly written points.
+    """
     try:
-        session.execute(
-            "BEGIN UNLOGGED BATCH\n" + "\n".join(statement) + "\nAPPLY BATCH"
+        windows = rollup.update_rollups(
+            contract_address, parse_timestring(earliest_written)
         )
         return {
-            "operation": f"floor/{len(floor_prices)}\n[\n    "
-            + ",\n    ".join([fpl["collection_address"] for fpl in floor_prices])
-            + "\n]",
+            "operation": f"rollups/{contract_address}",
             "status": "success",
+            "windows": windows,
         }
     except Exception as e:
         return {
-            "operation": f"floor/{len(floor_prices)}\n[\n    "
-            + ",\n    ".join([fpl["collection_address"] for fpl in floor_prices])
-            + "\n]",
+            "operation": f"rollups/{contract_address}",
             "status": "failed",
             "message": e.__str__(),
         }
 
 
+###############################################################################
+"""
+COLLECTIONS.FLOOR
+"""
+
+
+@app.task(name="update_floor")
+def update_floor(floor_prices=[], migrate: bool = True):
+    """
+    Refresh jobs migrate once all of their writes are done, rather than after each task.
+    """
+    session = CassandraDb.get_db_session()
+    statement = CassandraDb.get_statement("collection.update_floor")
+    # Listings without marketplaces have no floor to select.
+    floor_prices = [fpl for fpl in floor_prices if len(fpl["marketplaces"])]
+    floors = select_floors(floor_prices)
+    params = [
+        (floor, fpl["collection_address"])
+        for fpl, floor in zip(floor_prices, floors.tolist())
+    ]
+
+    # Each collection is its own partition, so rows are sent concurrently rather than batched.
+    results = execute_concurrent_with_args(
+        session, statement, params, concurrency=BATCH_STEP, raise_on_first_error=False
+    )
+    errors = [result.__str__() for success, result in results if not success]
+    change_log.record_collections(
+        address for (_, address), (success, _) in zip(params, results) if success
+    )
+    if migrate and len(errors) < len(params):
+        migrate_changes.delay()
+
+    operation = (
+        f"floor/{len(floor_prices)}\n[\n    "
+        + ",\n    ".join([fpl["collection_address"] for fpl in floor_prices])
+        + "\n]"
+    )
+    if not errors:
+        return {"operation": operation, "status": "success"}
+    return {
+        "operation": operation,
+        "status": "failed",
+        "message": ",\n".join(errors),
+    }
+
+
 ###############################################################################
 # Migrate existing index data to Postgres
 
 
-@app.task(name="migrate_collections")
-def migrate_collections():
+# Rows per Cassandra page, and so the most rows a migration holds in memory at once.
+MIGRATION_FETCH_SIZE = 1000
+
+# A sync awaited by a refresh job is retried until the running sync is done, for at least
+# as long as that sync may hold the lock.
+SYNC_RETRY_SECONDS = 30
+SYNC_MAX_RETRIES = change_log.SYNC_LOCK_TTL_SECONDS // SYNC_RETRY_SECONDS
+
+COLLECTION_COLUMNS = (
+    "address",
+    "name",
+    "type",
+    "tokens",
+    "owners",
+    "sales_volume",
+    "image",
+    "banner_image",
+    "description",
+    "external_url",
+    "floor",
+)
+RANKING_COLUMNS = ("duration", "rank", "collection", "value")
+
+
+def stream_table(table: str, columns):
+    """
+    Reads a Cassandra table page by page, so that only one page is held in memory.
+    """
     cassandra_session = CassandraDb.get_db_session()
-    res = cassandra_session.execute(
-        """
-        SELECT *
-        FROM collection
-        """
+    statement = SimpleStatement(
+        f"SELECT {', '.join(columns)} FROM {table}", fetch_size=MIGRATION_FETCH_SIZE
     )
-    query_string = """
-        INSERT INTO collection (address, name, type, tokens, owners, sales_volume, image, banner_image, description, external_url, floor)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-    tuples = []
-    for row in res:
-        tuples.append(
-            (
-                row.address,
-                row.name,
-                row.type,
-                row.tokens,
-                row.owners,
-                row.sales_volume,
-                row.image,
-                row.banner_image,
-                row.description,
-                row.external_url,
-                row.floor,
-            )
-        )
+    return cassandra_session.execute(statement)
+
+
+@app.task(name="migrate_collections")
+def migrate_collections():
     try:
-        PostgresSearchDb.execute_query("DELETE FROM collection")
-        res = PostgresSearchDb.execute_query_batch(query_string, tuples)
+        PostgresSearchDb.replace_table(
+            "collection",
+            COLLECTION_COLUMNS,
+            ("address",),
+            stream_table("collection", COLLECTION_COLUMNS),
+        )
         return "Collection - Success"
     except Exception as e:
         return e.__str__()
@@ -449,30 +555,17 @@ def migrate_collections():
 
 @app.task(name="migrate_rankings")
 def migrate_rankings():
-    cassandra_session = CassandraDb.get_db_session()
-    res = cassandra_session.execute(
-        """
-        SELECT *
-        FROM ranking
-        """
-    )
-    query_string = """
-        INSERT INTO ranking (duration, rank, collection, value)
-        VALUES (%s, %s, %s, %s)
-        """
-    tuples = []
-    for row in res:
-        tuples.append(
-            (
-                row.duration,
-                row.rank,
-                row.collection,
-                row.value,
-            )
-        )
     try:
-        PostgresSearchDb.execute_query("DELETE FROM ranking")
-        res = PostgresSearchDb.execute_query_batch(query_string, tuples)
+        generation = ranking_generation.get_active_generation()
+        if generation is None:
+            return "Ranking - Skipped, no ranking generation is active"
+        rows = stream_table("ranking", RANKING_COLUMNS + ("generation",))
+        PostgresSearchDb.replace_table(
+            "ranking",
+            RANKING_COLUMNS,
+            ("duration", "rank", "collection"),
+            (row[:-1] for row in rows if row[-1] == generation),
+        )
         return "Ranking - Success"
     except Exception as e:
         return e.__str__()
@@ -482,3 +575,123 @@ def migrate_rankings():
 def migrate():
     migrate_collections()
     migrate_rankings()
+
+
+@app.task(name="migrate_changes", bind=True, max_retries=SYNC_MAX_RETRIES)
+def migrate_changes(self):
+    """
+    Upserts only the collections and ranking partitions written since the last sync.
+
+    Collections are synced first, as rankings reference them. Collections deleted from
+    Cassandra are left to the full `migrate`. Ranking partitions are left in the change log
+    while no ranking generation is active.
+
+    Only one sync runs at a time. One queued while another runs is deferred, and the
+    running sync is queued again once it is done. A sync with callbacks, such as a refresh
+    job's, is instead retried until it runs, so that they are only called once it has.
+    """
+    token = uuid.uuid4().hex
+    if not change_log.acquire_sync(token):
+        if self.request.callbacks or self.request.errbacks:
+            raise self.retry(countdown=SYNC_RETRY_SECONDS)
+        return {
+            "operation": "migrate/changes",
+            "status": "deferred",
+            "message": "Deferred until the running sync is done",
+        }
+
+    session = CassandraDb.get_db_session()
+    try:
+        addresses = change_log.claim_collections()
+        results = execute_concurrent_with_args(
+            session,
+            CassandraDb.get_statement("collection.select"),
+            [(address,) for address in addresses],
+            concurrency=BATCH_STEP,
+        )
+        PostgresSearchDb.upsert_rows(
+            "collection",
+            COLLECTION_COLUMNS,
+            ("address",),
+            [tuple(row) for _, rows in results for row in rows],
+        )
+        change_log.release(change_log.COLLECTIONS_KEY)
+
+        partitions = []
+        generation = ranking_generation.get_active_generation()
+        if generation is not None:
+            partitions = change_log.claim_rankings()
+            statement = CassandraDb.get_statement("ranking.select_partition")
+            for rank, duration in partitions:
+                rows = session.execute(statement, [rank, duration, generation])
+                PostgresSearchDb.replace_partition(
+                    "ranking",
+                    RANKING_COLUMNS,
+                    {"rank": rank, "duration": duration},
+                    [tuple(row) for row in rows],
+                )
+            change_log.release(change_log.RANKINGS_KEY)
+
+        return {
+            "operation": "migrate/changes",
+            "status": "success",
+            "collections": len(addresses),
+            "rankings": len(partitions),
+        }
+    except Exception as e:
+        return {
+            "operation": "migrate/changes",
+            "status": "failed",
+            "message": e.__str__(),
+        }
+    finally:
+        if change_log.release_sync(token):
+            migrate_changes.delay()
+
+
+###############################################################################
+"""
+REFRESH JOBS
+"""
+
+
+def queue_migration(job_id: str):
+    jobs.set_stage(RedisDb.get_client(), job_id, jobs.MIGRATE, jobs.RUNNING)
+    migrate_changes.apply_async(
+        link=job_task_done.s(job_id, jobs.MIGRATE),
+        link_error=job_task_failed.s(job_id, jobs.MIGRATE),
+    )
+
+
+def finish_job_task(job_id: str, stage: str, failed: bool):
+    """
+    Counts a refresh job's finished task, migrating the job once its last write is done.
+    """
+    client = RedisDb.get_client()
+    if stage == jobs.MIGRATE:
+        status = jobs.FAILED if failed else jobs.DONE
+        jobs.set_stage(client, job_id, stage, status)
+        jobs.update(client, job_id, status=status)
+    elif jobs.task_done(client, job_id, stage, failed):
+        queue_migration(job_id)
+
+
+@app.task(name="job_task_done")
+def job_task_done(result, job_id: str, stage: str):
+    """
+    Linked to a refresh job's task, receiving its result.
+
+    Tasks report failures in `status`, as "failed" or their errors, while empty inputs
+    are "skipped". Any other status, such as a "deferred" sync, did not finish the task.
+    """
+    status = result.get("status") if isinstance(result, dict) else None
+    failed = status is not None and status not in ("success", "skipped")
+    finish_job_task(job_id, stage, failed)
+
+
+@app.task(name="job_task_failed")
+def job_task_failed(request, exc, traceback, job_id: str, stage: str):
+    """
+    Linked as the error callback of a refresh job's task, called when it raises.
+    """
+    finish_job_task(job_id, stage, True)
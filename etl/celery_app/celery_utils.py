@@ -1,24 +1,24 @@
 from datetime import datetime
+from decimal import Decimal
 
 TIME_INPUT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
-"2023-06-19T02:22:58.166"
-GALLOP_TIME_MICROS_INPUT_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
-GALLOP_TIME_INPUT_FORMAT = "%Y-%m-%dT%H:%M:%S"
 
-
-def format_timestring(timestamp: str):
-    return datetime.strptime(timestamp, TIME_INPUT_FORMAT).strftime(
-        "%Y-%m-%dT%H:%M:%S+0000"
-    )
+def parse_timestring(timestamp: str):
+    """
+    Parses a Mnemonic timestamp into a naive UTC datetime, for binding to a TIMESTAMP column.
+    """
+    return datetime.strptime(timestamp, TIME_INPUT_FORMAT)
 
 
 def or_else(value, default_value="0"):
     return default_value if not value else value
 
 
-def format_gallop_timestamp(timestamp: str):
-    try:
-        return datetime.strptime(timestamp, GALLOP_TIME_INPUT_FORMAT)
-    except ValueError:
-        return datetime.strptime(timestamp, GALLOP_TIME_MICROS_INPUT_FORMAT)
+def to_decimal(value):
+    return Decimal(str(or_else(value)))
+
+
+def to_bigint(value):
+    return int(to_decimal(value))
+
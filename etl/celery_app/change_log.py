@@ -0,0 +1,101 @@
+from typing import Iterable, List, Tuple
+
+from etl.database import RedisDb
+
+COLLECTIONS_KEY = "change_log:collection"
+RANKINGS_KEY = "change_log:ranking"
+PROCESSING_SUFFIX = ":processing"
+
+# Syncs share the processing sets, so only one runs at a time.
+SYNC_LOCK_KEY = "change_log:sync_lock"
+SYNC_RERUN_KEY = "change_log:sync_rerun"
+# Longer than a sync may take, after which the lock of a crashed worker is given up.
+SYNC_LOCK_TTL_SECONDS = 60 * 60
+
+# KEYS: lock, rerun flag. ARGV: token, TTL.
+# Returns 1 if the lock was taken, else asks its holder to sync again once done.
+ACQUIRE_SYNC_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+redis.call('SET', KEYS[2], 1, 'EX', ARGV[2])
+return 0
+"""
+
+# KEYS: lock, rerun flag. ARGV: token.
+# Returns 1 if another sync was asked for while the lock was held.
+RELEASE_SYNC_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return redis.call('DEL', KEYS[2])
+"""
+
+# KEYS: change log, processing set.
+# Moves the change log into the processing set, keeping entries left by a failed sync.
+CLAIM_SCRIPT = """
+redis.call('SUNIONSTORE', KEYS[2], KEYS[1], KEYS[2])
+redis.call('DEL', KEYS[1])
+return redis.call('SMEMBERS', KEYS[2])
+"""
+
+
+def record_collections(addresses: Iterable[str]):
+    addresses = list(addresses)
+    if addresses:
+        RedisDb.get_client().sadd(COLLECTIONS_KEY, *addresses)
+
+
+def record_ranking(rank: str, duration: str):
+    RedisDb.get_client().sadd(RANKINGS_KEY, f"{rank}/{duration}")
+
+
+def claim(key: str) -> List[str]:
+    """
+    Returns the entries written since the last sync.
+
+    They stay claimed until `release`d, and are returned again by the next claim if the
+    sync fails before then.
+    """
+    members = RedisDb.get_client().eval(CLAIM_SCRIPT, 2, key, key + PROCESSING_SUFFIX)
+    return sorted(member.decode() for member in members)
+
+
+def release(key: str):
+    RedisDb.get_client().delete(key + PROCESSING_SUFFIX)
+
+
+def acquire_sync(token: str) -> bool:
+    """
+    Takes the sync lock. If another sync holds it, that sync runs again once it is done,
+    so that changes recorded after its claim are not left waiting.
+    """
+    return bool(
+        RedisDb.get_client().eval(
+            ACQUIRE_SYNC_SCRIPT,
+            2,
+            SYNC_LOCK_KEY,
+            SYNC_RERUN_KEY,
+            token,
+            SYNC_LOCK_TTL_SECONDS,
+        )
+    )
+
+
+def release_sync(token: str) -> bool:
+    """
+    Releases the sync lock, returning whether another sync should now be queued.
+    """
+    return bool(
+        RedisDb.get_client().eval(
+            RELEASE_SYNC_SCRIPT, 2, SYNC_LOCK_KEY, SYNC_RERUN_KEY, token
+        )
+    )
+
+
+def claim_collections() -> List[str]:
+    return claim(COLLECTIONS_KEY)
+
+
+def claim_rankings() -> List[Tuple[str, str]]:
+    return [tuple(member.split("/", 1)) for member in claim(RANKINGS_KEY)]
@@ -0,0 +1,224 @@
+import logging
+import time
+from itertools import repeat
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType, PreparedStatement
+
+from etl.database import CassandraDb
+
+from .transform import (
+    BIGINT,
+    DECIMAL,
+    SeriesColumns,
+    format_timestamps,
+    series_to_columns,
+)
+
+BATCH_STEP = 30
+
+# Send rows through the driver's concurrent execution path instead of UNLOGGED batches.
+CONCURRENT_WRITES = False
+
+logger = logging.getLogger(__name__)
+
+# Series name -> ((data_point column, Mnemonic data point key, column type), ...)
+SERIES_COLUMNS = {
+    "prices": (
+        ("min_price", "min", DECIMAL),
+        ("max_price", "max", DECIMAL),
+        ("average_price", "avg", DECIMAL),
+    ),
+    "sales": (
+        ("sales_count", "quantity", BIGINT),
+        ("sales_volume", "volume", DECIMAL),
+    ),
+    "tokens": (
+        ("tokens_minted", "minted", BIGINT),
+        ("tokens_burned", "burned", BIGINT),
+        ("total_minted", "totalMinted", BIGINT),
+        ("total_burned", "totalBurned", BIGINT),
+    ),
+    "owners": (("owners_count", "count", BIGINT),),
+}
+
+
+def data_point_update_cql(columns):
+    assignments = ",\n               ".join(f"{column} = ?" for column in columns)
+    return f"""
+        UPDATE data_point
+           SET {assignments}
+        WHERE collection = ?
+          AND time_stamp = ?
+        """
+
+
+def statement_name(series: Tuple[str, ...]):
+    return "data_point." + "+".join(series)
+
+
+# One statement per series, and one for the joined row of all series.
+for _series in [(name,) for name in SERIES_COLUMNS] + [tuple(SERIES_COLUMNS)]:
+    CassandraDb.register_statement(
+        statement_name(_series),
+        "data_point",
+        data_point_update_cql(
+            [column for name in _series for column, _, _ in SERIES_COLUMNS[name]]
+        ),
+    )
+
+
+class DataPointWriter:
+    """
+    Writes rows of a single collection's `data_point` partition with prepared statements.
+
+    As every row shares the partition key, rows are grouped into UNLOGGED batches, which
+    skip the batchlog while still being applied as a single mutation by the replica.
+    """
+
+    def __init__(
+        self,
+        session,
+        contract_address: str,
+        batch_size: int = BATCH_STEP,
+        concurrent: bool = CONCURRENT_WRITES,
+    ):
+        self.session = session
+        self.contract_address = contract_address
+        self.batch_size = batch_size
+        self.concurrent = concurrent
+        self.rows: List[Tuple[PreparedStatement, list]] = []
+
+    def get_statement(self, series: Tuple[str, ...]) -> PreparedStatement:
+        """
+        Returns the statement updating the columns of every named series at once.
+        """
+        return CassandraDb.get_statement(statement_name(series))
+
+    def _add_rows(self, series: Tuple[str, ...], columns: Dict[str, SeriesColumns]):
+        """
+        Binds a row per timestamp from the given, aligned columns of each series.
+        """
+        time_stamp = columns[series[0]].time_stamp
+        params = []
+        for name in series:
+            for column, _, _ in SERIES_COLUMNS[name]:
+                params.append(columns[name].values[column].tolist())
+        params += [repeat(self.contract_address), time_stamp.tolist()]
+
+        statement = self.get_statement(series)
+        self.rows += [(statement, list(row)) for row in zip(*params)]
+
+    def add_series(self, series: str, data_points):
+        columns = series_to_columns(data_points, SERIES_COLUMNS[series])
+        self._add_rows((series,), {series: columns})
+
+    def add_joined_series(self, series_points: Dict[str, list]) -> Dict[str, List[str]]:
+        """
+        Joins several series on timestamp so that each `data_point` row is written once.
+
+        Timestamps present in every series are written with a single wide UPDATE. The rest
+        fall back to one UPDATE per series present, so that absent columns are left as-is
+        instead of being overwritten with nulls.
+
+        Returns the timestamps missing from each series.
+        """
+        all_series = tuple(series_points)
+        columns = {
+            series: series_to_columns(data_points, SERIES_COLUMNS[series])
+            for series, data_points in series_points.items()
+        }
+        time_stamp = np.unique(
+            np.concatenate([columns[series].time_stamp for series in all_series])
+        )
+
+        positions, present = {}, {}
+        for series in all_series:
+            series_time_stamp = columns[series].time_stamp
+            positions[series] = np.searchsorted(series_time_stamp, time_stamp)
+            present[series] = np.zeros(len(time_stamp), dtype=bool)
+            if len(series_time_stamp):
+                clipped = np.minimum(positions[series], len(series_time_stamp) - 1)
+                present[series] = series_time_stamp[clipped] == time_stamp
+        complete = np.logical_and.reduce([present[series] for series in all_series])
+
+        self._add_rows(
+            all_series,
+            {
+                series: columns[series].take(positions[series][complete])
+                for series in all_series
+            },
+        )
+        for series in all_series:
+            partial = present[series] & ~complete
+            self._add_rows(
+                (series,), {series: columns[series].take(positions[series][partial])}
+            )
+
+        return {
+            series: format_timestamps(time_stamp[~present[series]])
+            for series in all_series
+        }
+
+    def get_time_span(self):
+        """
+        Returns the earliest and latest timestamps of the pending rows.
+        """
+        time_stamps = [params[-1] for _, params in self.rows]
+        return min(time_stamps), max(time_stamps)
+
+    def _execute_batch(self, rows):
+        batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+        for statement, params in rows:
+            batch.add(statement, params)
+        self.session.execute(batch)
+        return []
+
+    def _execute_concurrent(self, rows):
+        results = execute_concurrent(
+            self.session, rows, concurrency=self.batch_size, raise_on_first_error=False
+        )
+        return [result.__str__() for success, result in results if not success]
+
+    def flush(self):
+        """
+        Sends all pending rows, returning per-batch row counts, latencies and errors.
+        """
+        batches, errors = [], []
+        for i in range(0, len(self.rows), self.batch_size):
+            rows = self.rows[i : i + self.batch_size]
+            start = time.perf_counter()
+            try:
+                if self.concurrent:
+                    batch_errors = self._execute_concurrent(rows)
+                else:
+                    batch_errors = self._execute_batch(rows)
+            except Exception as e:
+                batch_errors = [e.__str__()]
+            latency_ms = round((time.perf_counter() - start) * 1000, 2)
+
+            batch = {"rows": len(rows), "latency_ms": latency_ms}
+            if batch_errors:
+                batch["errors"] = batch_errors
+                errors += batch_errors
+                logger.warning(
+                    "data_point/%s: batch of %d failed in %.2fms: %s",
+                    self.contract_address,
+                    len(rows),
+                    latency_ms,
+                    batch_errors[0],
+                )
+            else:
+                logger.info(
+                    "data_point/%s: batch of %d written in %.2fms",
+                    self.contract_address,
+                    len(rows),
+                    latency_ms,
+                )
+            batches.append(batch)
+
+        self.rows = []
+        return {"batches": batches, "errors": errors}
@@ -25,6 +25,27 @@ class Collection(Model):
         PRIMARY KEY (address)
     );
     ```
+
+    Collections are searched in Postgres, which needs these indexes:
+
+    ```sql
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+    -- Prefix, substring and fuzzy matching of names and descriptions
+    CREATE INDEX collection_name_trgm ON collection USING GIN (name gin_trgm_ops);
+    CREATE INDEX collection_description_trgm
+        ON collection USING GIN (description gin_trgm_ops);
+
+    -- Keyset pagination by each sort, optionally within a type
+    CREATE INDEX collection_floor_keyset
+        ON collection (COALESCE(floor, -1) DESC, address DESC);
+    CREATE INDEX collection_owners_keyset
+        ON collection (COALESCE(owners, -1) DESC, address DESC);
+    CREATE INDEX collection_sales_volume_keyset
+        ON collection (COALESCE(sales_volume, -1) DESC, address DESC);
+    CREATE INDEX collection_type_sales_volume_keyset
+        ON collection (type, COALESCE(sales_volume, -1) DESC, address DESC);
+    ```
     """
 
     __table_name__ = "collection"
@@ -69,11 +90,15 @@ class Ranking(Model):
         collection TEXT,
         duration TEXT,
         rank TEXT,
+        generation TEXT,
         value DECIMAL,
-        PRIMARY KEY ((rank, duration), collection)
+        PRIMARY KEY ((rank, duration, generation), collection)
     );
     ```
 
+    Each ranking refresh is written under a new generation, and only read once
+    `ranking_generation` points at it.
+
     ```sql
     CREATE TABLE ranking (
         duration VARCHAR(30),
@@ -93,9 +118,57 @@ class Ranking(Model):
     value = columns.Decimal(required=True)
     ranking = columns.Text(primary_key=True, required=True, partition_key=True)
     duration = columns.Text(primary_key=True, required=True, partition_key=True)
+    generation = columns.Text(primary_key=True, required=True, partition_key=True)
     collection = columns.Text(primary_key=True, required=True)
 
 
+class RankingGeneration(Model):
+    """
+    The ORM creates definitions which are hard to work with.
+    Therefore, create this table using the following CQL command:
+
+    ```cql
+    CREATE TABLE ranking_generation (
+        name TEXT,
+        generation TEXT,
+        PRIMARY KEY (name)
+    );
+    ```
+
+    The `active` row points at the ranking generation read from.
+    """
+
+    __keyspace__ = "nf-main-keyspace"
+    __connection__ = "cluster1"
+    name = columns.Text(primary_key=True, required=True)
+    generation = columns.Text(required=True)
+
+
+class RankingPartition(Model):
+    """
+    The ORM creates definitions which are hard to work with.
+    Therefore, create this table using the following CQL command:
+
+    ```cql
+    CREATE TABLE ranking_partition (
+        generation TEXT,
+        rank TEXT,
+        duration TEXT,
+        PRIMARY KEY (generation, rank, duration)
+    );
+    ```
+
+    The `ranking` partitions written under each generation, so that old generations can
+    be deleted.
+    """
+
+    __keyspace__ = "nf-main-keyspace"
+    __connection__ = "cluster1"
+    generation = columns.Text(primary_key=True, required=True, partition_key=True)
+    rank = columns.Text(primary_key=True, required=True)
+    duration = columns.Text(primary_key=True, required=True)
+
+
 class DataPoint(Model):
     """
     The ORM creates definitions which are hard to work with.
@@ -142,6 +215,52 @@ class DataPoint(Model):
     owners_count = columns.BigInt()
 
 
+class CollectionRollup(Model):
+    """
+    The ORM creates definitions which are hard to work with.
+    Therefore, create this table using the following CQL command:
+
+    ```cql
+    CREATE TABLE collection_rollup (
+        collection TEXT,
+        window_days INT,
+        window_start TIMESTAMP,
+        window_end TIMESTAMP,
+        points INT,
+        sales_volume DECIMAL,
+        sales_count BIGINT,
+        min_price DECIMAL,
+        max_price DECIMAL,
+        average_price DECIMAL,
+        owners_change BIGINT,
+        supply_change BIGINT,
+        updated_at TIMESTAMP,
+        PRIMARY KEY (collection, window_days)
+    );
+    ```
+
+    Aggregates of the `data_point` rows in `(window_start, window_end]`, the last
+    `window_days` days up to the collection's latest point.
+    """
+
+    collection = columns.Text(partition_key=True, primary_key=True, required=True)
+    window_days = columns.Integer(primary_key=True, required=True)
+
+    window_start = columns.DateTime()
+    window_end = columns.DateTime()
+    points = columns.Integer()
+
+    sales_volume = columns.Decimal()
+    sales_count = columns.BigInt()
+    min_price = columns.Decimal()
+    max_price = columns.Decimal()
+    average_price = columns.Decimal()
+    owners_change = columns.BigInt()
+    supply_change = columns.BigInt()
+
+    updated_at = columns.DateTime()
+
+
 class AdminUser(Model):
     """
     CREATE TABLE admin_user (
@@ -0,0 +1,186 @@
+from typing import List, Optional, Set, Tuple
+
+from etl.config import LEADERBOARD_CACHE_PREFIX, RANKING_GENERATION_KEY
+from etl.database import CassandraDb, RedisDb
+
+# Generation ids are UTC timestamps, so later generations sort after earlier ones.
+# Longer than a ranking refresh may take to be written.
+BARRIER_TTL_SECONDS = 24 * 60 * 60
+
+# KEYS: pages done, pages failed, pages expected. ARGV: whether the page failed, TTL.
+# Returns 1 to the last page of a sealed generation, so that exactly one caller activates it.
+PAGE_DONE_SCRIPT = """
+local done = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if ARGV[1] == '1' then
+    redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+local expected = redis.call('GET', KEYS[3])
+if expected and done == tonumber(expected) then
+    return 1
+end
+return 0
+"""
+
+# KEYS: pages done, pages expected. ARGV: pages sent, TTL.
+# Returns 1 if every page was already done, in which case no page will activate it.
+SEAL_SCRIPT = """
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+local done = tonumber(redis.call('GET', KEYS[1]) or '0')
+if done == tonumber(ARGV[1]) then
+    return 1
+end
+return 0
+"""
+
+CassandraDb.register_statement(
+    "ranking_generation.select",
+    "ranking_generation",
+    "SELECT generation FROM ranking_generation WHERE name = 'active'",
+)
+CassandraDb.register_statement(
+    "ranking_generation.update",
+    "ranking_generation",
+    "UPDATE ranking_generation SET generation = ? WHERE name = 'active'",
+)
+CassandraDb.register_statement(
+    "ranking_partition.insert",
+    "ranking_partition",
+    "INSERT INTO ranking_partition (generation, rank, duration) VALUES (?, ?, ?)",
+)
+CassandraDb.register_statement(
+    "ranking_partition.select",
+    "ranking_partition",
+    "SELECT rank, duration FROM ranking_partition WHERE generation = ?",
+)
+CassandraDb.register_statement(
+    "ranking_partition.generations",
+    "ranking_partition",
+    "SELECT DISTINCT generation FROM ranking_partition",
+)
+CassandraDb.register_statement(
+    "ranking_partition.delete",
+    "ranking_partition",
+    "DELETE FROM ranking_partition WHERE generation = ?",
+)
+CassandraDb.register_statement(
+    "ranking.delete_partition",
+    "ranking",
+    "DELETE FROM ranking WHERE rank = ? AND duration = ? AND generation = ?",
+)
+
+
+def get_barrier_keys(generation: str):
+    prefix = f"ranking_generation:{generation}"
+    return f"{prefix}:done", f"{prefix}:failed", f"{prefix}:expected"
+
+
+def get_active_generation() -> Optional[str]:
+    client = RedisDb.get_client()
+    generation = client.get(RANKING_GENERATION_KEY)
+    if generation is not None:
+        return generation.decode()
+
+    session = CassandraDb.get_db_session()
+    row = session.execute(CassandraDb.get_statement("ranking_generation.select")).one()
+    if row is None:
+        return None
+    client.set(RANKING_GENERATION_KEY, row.generation)
+    return row.generation
+
+
+def record_partition(generation: str, rank: str, duration: str):
+    CassandraDb.get_db_session().execute(
+        CassandraDb.get_statement("ranking_partition.insert"),
+        [generation, rank, duration],
+    )
+
+
+def get_partitions(generation: str) -> List[Tuple[str, str]]:
+    rows = CassandraDb.get_db_session().execute(
+        CassandraDb.get_statement("ranking_partition.select"), [generation]
+    )
+    return [(row.rank, row.duration) for row in rows]
+
+
+def page_done(generation: str, failed: bool = False) -> bool:
+    """
+    Counts a written page of a generation, returning whether it completed the generation.
+    """
+    done, failures, expected = get_barrier_keys(generation)
+    return bool(
+        RedisDb.get_client().eval(
+            PAGE_DONE_SCRIPT,
+            3,
+            done,
+            failures,
+            expected,
+            int(failed),
+            BARRIER_TTL_SECONDS,
+        )
+    )
+
+
+def seal(generation: str, page_count: int) -> bool:
+    """
+    Records how many pages a generation was sent in, returning whether all were written.
+    """
+    done, _, expected = get_barrier_keys(generation)
+    return bool(
+        RedisDb.get_client().eval(
+            SEAL_SCRIPT, 2, done, expected, page_count, BARRIER_TTL_SECONDS
+        )
+    )
+
+
+def get_failures(generation: str) -> int:
+    _, failures, _ = get_barrier_keys(generation)
+    return int(RedisDb.get_client().get(failures) or 0)
+
+
+def activate(generation: str):
+    """
+    Points readers at `generation`.
+    """
+    CassandraDb.get_db_session().execute(
+        CassandraDb.get_statement("ranking_generation.update"), [generation]
+    )
+    RedisDb.get_client().set(RANKING_GENERATION_KEY, generation)
+
+
+def invalidate_leaderboards(generation: str):
+    """
+    Drops the API's cached leaderboard pages of a generation that is no longer active.
+    """
+    client = RedisDb.get_client()
+    keys = list(client.scan_iter(match=f"{LEADERBOARD_CACHE_PREFIX}:{generation}:*"))
+    if keys:
+        client.delete(*keys)
+
+
+def collect_garbage(keep: Set[str], before: str) -> List[str]:
+    """
+    Deletes the generations older than `before`, other than those to `keep`.
+
+    Newer generations may still be being written, so they are left alone.
+    """
+    session = CassandraDb.get_db_session()
+    generations = [
+        row.generation
+        for row in session.execute(
+            CassandraDb.get_statement("ranking_partition.generations")
+        )
+    ]
+    collected = []
+    delete_partition = CassandraDb.get_statement("ranking.delete_partition")
+    for generation in generations:
+        if generation in keep or generation >= before:
+            continue
+        for rank, duration in get_partitions(generation):
+            session.execute(delete_partition, [rank, duration, generation])
+        session.execute(
+            CassandraDb.get_statement("ranking_partition.delete"), [generation]
+        )
+        collected.append(generation)
+    return collected
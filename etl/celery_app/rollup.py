@@ -0,0 +1,191 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from etl.database import CassandraDb
+
+ROLLUP_WINDOWS = (7, 30, 90, 365)
+
+ROLLUP_SOURCE_COLUMNS = (
+    "min_price",
+    "max_price",
+    "sales_count",
+    "sales_volume",
+    "total_minted",
+    "total_burned",
+    "owners_count",
+)
+
+CassandraDb.register_statement(
+    "rollup.data_point_since",
+    "data_point",
+    f"""
+    SELECT time_stamp, {", ".join(ROLLUP_SOURCE_COLUMNS)}
+    FROM data_point
+    WHERE collection = ?
+      AND time_stamp > ?
+    """,
+)
+CassandraDb.register_statement(
+    "rollup.data_point_latest",
+    "data_point",
+    """
+    SELECT time_stamp
+    FROM data_point
+    WHERE collection = ?
+    ORDER BY time_stamp DESC
+    LIMIT 1
+    """,
+)
+CassandraDb.register_statement(
+    "rollup.select_window_ends",
+    "collection_rollup",
+    """
+    SELECT window_days, window_end
+    FROM collection_rollup
+    WHERE collection = ?
+    """,
+)
+CassandraDb.register_statement(
+    "rollup.upsert",
+    "collection_rollup",
+    """
+    UPDATE collection_rollup
+    SET window_start = ?,
+        window_end = ?,
+        points = ?,
+        sales_volume = ?,
+        sales_count = ?,
+        min_price = ?,
+        max_price = ?,
+        average_price = ?,
+        owners_change = ?,
+        supply_change = ?,
+        updated_at = ?
+    WHERE collection = ?
+      AND window_days = ?
+    """,
+)
+
+
+def get_touched_windows(
+    latest: datetime, earliest_written: datetime, window_ends: Dict[int, datetime]
+) -> List[int]:
+    """
+    Returns the windows, in days up to `latest`, whose aggregates new points may change.
+
+    A window is touched if it has slid to a new latest point, or if a point was written
+    inside it. Backfilled points older than a window leave it untouched.
+    """
+    return [
+        days
+        for days in ROLLUP_WINDOWS
+        if window_ends.get(days) != latest
+        or earliest_written > latest - timedelta(days=days)
+    ]
+
+
+def select(values: Sequence, indices: np.ndarray) -> list:
+    """
+    Returns the values at `indices`, skipping missing ones.
+    """
+    return [values[i] for i in indices if values[i] is not None]
+
+
+def get_change(values: list):
+    return values[-1] - values[0] if values else None
+
+
+def compute_rollup(rows: Dict[str, list], mask: np.ndarray) -> dict:
+    """
+    Aggregates the masked, time-ordered rows of a window.
+
+    DECIMAL and BIGINT values are aggregated as `Decimal` and `int`, so that no precision
+    is lost, while numpy only selects the window's rows.
+    """
+    indices = np.flatnonzero(mask)
+    sales_volume = sum(select(rows["sales_volume"], indices), Decimal(0))
+    sales_count = sum(select(rows["sales_count"], indices))
+    min_prices = select(rows["min_price"], indices)
+    max_prices = select(rows["max_price"], indices)
+    supply = [
+        minted - burned
+        for minted, burned in zip(
+            (rows["total_minted"][i] for i in indices),
+            (rows["total_burned"][i] for i in indices),
+        )
+        if minted is not None and burned is not None
+    ]
+    return {
+        "points": len(indices),
+        "sales_volume": sales_volume,
+        "sales_count": sales_count,
+        "min_price": min(min_prices) if min_prices else None,
+        "max_price": max(max_prices) if max_prices else None,
+        # The average price of every sale in the window, rather than of daily averages.
+        "average_price": sales_volume / sales_count if sales_count else None,
+        "owners_change": get_change(select(rows["owners_count"], indices)),
+        "supply_change": get_change(supply),
+    }
+
+
+def update_rollups(contract_address: str, earliest_written: datetime) -> List[int]:
+    """
+    Recomputes a collection's rollups touched by points written from `earliest_written`,
+    reading only the span of the largest touched window.
+
+    Returns the windows recomputed.
+    """
+    session = CassandraDb.get_db_session()
+    latest_row = session.execute(
+        CassandraDb.get_statement("rollup.data_point_latest"), [contract_address]
+    ).one()
+    if latest_row is None:
+        return []
+    latest = latest_row.time_stamp
+
+    window_ends = {
+        row.window_days: row.window_end
+        for row in session.execute(
+            CassandraDb.get_statement("rollup.select_window_ends"), [contract_address]
+        )
+    }
+    touched = get_touched_windows(latest, earliest_written, window_ends)
+    if not touched:
+        return []
+
+    rows = {column: [] for column in ("time_stamp",) + ROLLUP_SOURCE_COLUMNS}
+    for row in session.execute(
+        CassandraDb.get_statement("rollup.data_point_since"),
+        [contract_address, latest - timedelta(days=max(touched))],
+    ):
+        for column in rows:
+            rows[column].append(getattr(row, column))
+    time_stamp = np.array(rows["time_stamp"], dtype="datetime64[ms]")
+
+    statement = CassandraDb.get_statement("rollup.upsert")
+    updated_at = datetime.utcnow()
+    for days in touched:
+        window_start = latest - timedelta(days=days)
+        rollup = compute_rollup(rows, time_stamp > np.datetime64(window_start, "ms"))
+        session.execute(
+            statement,
+            [
+                window_start,
+                latest,
+                rollup["points"],
+                rollup["sales_volume"],
+                rollup["sales_count"],
+                rollup["min_price"],
+                rollup["max_price"],
+                rollup["average_price"],
+                rollup["owners_change"],
+                rollup["supply_change"],
+                updated_at,
+                contract_address,
+                days,
+            ],
+        )
+    return touched
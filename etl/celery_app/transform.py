@@ -0,0 +1,131 @@
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from .celery_utils import to_bigint, to_decimal
+
+DECIMAL = "decimal"
+BIGINT = "bigint"
+
+# (data_point column, Mnemonic data point key, DECIMAL or BIGINT)
+Field = Tuple[str, str, str]
+
+
+class SeriesColumns(NamedTuple):
+    """
+    A Mnemonic series as columns, sorted by timestamp.
+    """
+
+    time_stamp: np.ndarray  # datetime64[s]
+    values: Dict[str, np.ndarray]  # column -> Decimal for DECIMAL, int for BIGINT
+
+    def take(self, indices: np.ndarray) -> "SeriesColumns":
+        return SeriesColumns(
+            self.time_stamp[indices],
+            {column: values[indices] for column, values in self.values.items()},
+        )
+
+
+def parse_timestamps(timestamps: Sequence[str], unit: str = "s") -> np.ndarray:
+    """
+    Parses ISO 8601 UTC timestamps, with or without a trailing `Z`, into datetime64.
+    """
+    return np.char.rstrip(np.asarray(timestamps, dtype=str), "Z").astype(
+        f"datetime64[{unit}]"
+    )
+
+
+def format_timestamps(time_stamp: np.ndarray) -> List[str]:
+    """
+    Formats datetime64 values back into Mnemonic's timestamp format.
+    """
+    return [f"{t}Z" for t in np.datetime_as_string(time_stamp, unit="s")]
+
+
+def parse_numbers(values: Sequence, kind: str = DECIMAL) -> np.ndarray:
+    """
+    Parses numbers, or numeric strings, filling missing values with 0.
+
+    Values are converted exactly, as `Decimal` or `int` in an object array, since a float
+    would round DECIMAL and large BIGINT values.
+    """
+    convert = to_bigint if kind == BIGINT else to_decimal
+    numbers = np.empty(len(values), dtype=object)
+    numbers[:] = [convert(value) for value in values]
+    return numbers
+
+
+def parse_floats(values: Sequence) -> np.ndarray:
+    """
+    Parses numbers, or numeric strings, into float64 for comparisons, filling missing
+    values with 0.
+    """
+    raw = np.asarray(values, dtype=object)
+    nulls = np.equal(raw, None) | np.equal(raw, "")
+    return np.where(nulls, "0", raw).astype(str).astype(np.float64)
+
+
+def series_to_columns(data_points: Sequence[dict], fields: Sequence[Field]):
+    time_stamp = parse_timestamps([point["timestamp"] for point in data_points])
+    values = {
+        column: parse_numbers([point[key] for point in data_points], kind)
+        for column, key, kind in fields
+    }
+    return SeriesColumns(time_stamp, values).take(
+        np.argsort(time_stamp, kind="stable")
+    )
+
+
+def select_floors(floor_prices: Sequence[dict]) -> np.ndarray:
+    """
+    Selects the floor price of each collection from its marketplace listings.
+
+    The first listing's floor is kept, unless a later listing was updated after it with a
+    non-zero floor, in which case the last such listing's floor is taken. A zero first floor
+    is replaced by the first non-zero floor of the other listings.
+
+    Listings are compared as floats, while the selected floors are returned as the exact
+    `Decimal` of each listing.
+    """
+    counts = np.array(
+        [len(fpl["marketplaces"]) for fpl in floor_prices], dtype=np.int64
+    )
+    listings = [listing for fpl in floor_prices for listing in fpl["marketplaces"]]
+    exact_floors = parse_numbers([listing["floor_price"] for listing in listings])
+    # Pad with a zero floor, for collections without a matching listing.
+    padded = np.append(exact_floors, to_decimal(0))
+    if not listings:
+        return padded[np.zeros(len(counts), dtype=np.int64)]
+    floors = parse_floats([listing["floor_price"] for listing in listings])
+    updated_at = parse_timestamps(
+        [listing["updated_at"] for listing in listings], unit="us"
+    )
+
+    collection_count, listing_count = len(counts), len(listings)
+    group = np.repeat(np.arange(collection_count), counts)
+    first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    index = np.arange(listing_count)
+    has_listings = counts > 0
+    is_first = np.zeros(listing_count, dtype=bool)
+    is_first[first[has_listings]] = True
+
+    first_floor = np.zeros(collection_count)
+    first_floor[has_listings] = floors[first[has_listings]]
+    first_index = np.where(has_listings, first, listing_count)
+    first_updated_at = updated_at[np.minimum(first, listing_count - 1)][group]
+
+    later_non_zero = (floors != 0) & ~is_first
+    newer = later_non_zero & (updated_at > first_updated_at)
+
+    last_newer = np.full(collection_count, -1)
+    np.maximum.at(last_newer, group[newer], index[newer])
+    first_non_zero = np.full(collection_count, listing_count)
+    np.minimum.at(first_non_zero, group[later_non_zero], index[later_non_zero])
+
+    return padded[
+        np.where(
+            last_newer >= 0,
+            last_newer,
+            np.where(first_floor != 0, first_index, first_non_zero),
+        )
+    ]
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import uuid
+
+from etl.database import RedisDb
+
+# Payloads larger than this are kept in Redis, and only their key sent through the broker.
+CLAIM_CHECK_THRESHOLD_BYTES = int(
+    os.getenv("CLAIM_CHECK_THRESHOLD_BYTES", 64 * 1024)
+)
+# Longer than a message may wait in the queue during a backfill.
+CLAIM_CHECK_TTL_SECONDS = int(os.getenv("CLAIM_CHECK_TTL_SECONDS", 24 * 60 * 60))
+# Released payloads are kept briefly, for a message redelivered before it was acked.
+CLAIM_CHECK_GRACE_SECONDS = 60
+
+KEY_PREFIX = "claim_check"
+
+# KEYS: payload key, claims key. ARGV: payload, claim, TTL.
+# Equal payloads share a key, so every message holds its own claim on its payload.
+CHECK_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+"""
+
+# KEYS: payload key, claims key. ARGV: claim, grace period.
+# Expires the payload shortly once its last claim is released. Releasing a claim twice
+# has no effect.
+RELEASE_SCRIPT = """
+redis.call('SREM', KEYS[2], ARGV[1])
+if redis.call('SCARD', KEYS[2]) == 0 then
+    redis.call('DEL', KEYS[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+
+def get_keys(digest: str):
+    return f"{KEY_PREFIX}:{digest}", f"{KEY_PREFIX}:{digest}:claims"
+
+
+def parse_reference(reference: str):
+    digest, _, message_claim = reference.partition(":")
+    return digest, message_claim
+
+
+def check(payload: bytes) -> str:
+    """
+    Stores a payload under its SHA-256 digest, returning the reference to send instead,
+    which also names the message's claim on the payload.
+    """
+    digest = hashlib.sha256(payload).hexdigest()
+    message_claim = uuid.uuid4().hex
+    client = RedisDb.get_client()
+    client.eval(
+        CHECK_SCRIPT,
+        2,
+        *get_keys(digest),
+        payload,
+        message_claim,
+        CLAIM_CHECK_TTL_SECONDS,
+    )
+    return f"{digest}:{message_claim}"
+
+
+def claim(reference: str) -> bytes:
+    """
+    Returns the payload a reference points to. It is only read, as a message may be
+    decoded several times before its task runs.
+    """
+    digest, _ = parse_reference(reference)
+    payload = RedisDb.get_client().get(get_keys(digest)[0])
+    if payload is None:
+        raise LookupError(f"Claim check {digest} has expired or was never stored")
+    return payload
+
+
+def release(reference: str):
+    """
+    Releases a message's claim on its payload, once its task has run.
+    """
+    digest, message_claim = parse_reference(reference)
+    RedisDb.get_client().eval(
+        RELEASE_SCRIPT,
+        2,
+        *get_keys(digest),
+        message_claim,
+        CLAIM_CHECK_GRACE_SECONDS,
+    )
@@ -1,4 +1,8 @@
 BROKER_URL = "amqp://rabbitmq"
 REDIS_URL = "redis://redis"
 
-CELERY_APP_NAME = "etl_celery"
\ No newline at end of file
+CELERY_APP_NAME = "etl_celery"
+
+# Redis keys shared by the API and the workers
+RANKING_GENERATION_KEY = "ranking_generation:active"
+LEADERBOARD_CACHE_PREFIX = "leaderboard"
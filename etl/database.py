@@ -1,10 +1,21 @@
+import io
+import logging
 import os
+import time
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from typing import Dict, Iterable, List, Sequence
+
+import redis
 from dotenv import load_dotenv
 from cassandra.auth import PlainTextAuthProvider
 from cassandra.cluster import Cluster
 
-from psycopg2 import pool
-from psycopg2.extras import execute_batch
+import psycopg2
+from psycopg2 import pool, sql
+from psycopg2.extras import RealDictCursor, execute_batch, execute_values
+
+from etl.config import REDIS_URL
 
 # from ssl import CERT_NONE, PROTOCOL_TLSv1_2, SSLContext
 # from cassandra.cqlengine import connection
@@ -26,11 +37,19 @@ AUTH_PROVIDER = PlainTextAuthProvider(CASSANDRA_CLIENT_ID, CASSANDRA_CLIENT_SECR
 
 COSMOS_KEYSPACE = "nf-main-keyspace"
 
+logger = logging.getLogger(__name__)
+
 
 class CassandraDb:
     db_session = None
     db_connection = None
 
+    # Statement name -> (table, CQL). Registered at import, prepared once per process.
+    statements = {}
+    # Statement name -> (PreparedStatement, TableMetadata it was prepared against)
+    prepared_statements = {}
+    statement_stats = {"hits": 0, "misses": 0}
+
     @classmethod
     def c_init(cls, **kwargs):
         """
@@ -66,6 +85,8 @@ class CassandraDb:
         cls.db_session = db_session
         # cls.db_connection = db_connection
 
+        cls.prepare_statements()
+
     # @classmethod
     # def get_db_connection(cls, **kwargs):
     #     if cls.db_connection is not None:
@@ -80,52 +101,392 @@ class CassandraDb:
         CassandraDb.c_init()
         return cls.db_session
 
+    @classmethod
+    def register_statement(cls, name: str, table: str, cql: str):
+        """
+        Registers a named statement to be prepared when the session is initialised.
+        """
+        cls.statements[name] = (table, cql)
+        cls.prepared_statements.pop(name, None)
+
+    @classmethod
+    def prepare_statements(cls):
+        """
+        Prepares every registered statement. One that fails, e.g. as its table is not yet
+        created, is logged and left to be prepared on demand by `get_statement`.
+        """
+        for name in cls.statements:
+            try:
+                cls._prepare(name)
+            except Exception:
+                logger.exception("Could not prepare statement '%s'", name)
+
+    @classmethod
+    def _table_metadata(cls, table: str):
+        keyspace = cls.db_session.cluster.metadata.keyspaces.get(CASSANDRA_KEYSPACE)
+        return keyspace.tables.get(table) if keyspace is not None else None
+
+    @classmethod
+    def _prepare(cls, name: str):
+        table, cql = cls.statements[name]
+        statement = cls.db_session.prepare(cql)
+        cls.prepared_statements[name] = (statement, cls._table_metadata(table))
+        return statement
+
+    @classmethod
+    def get_statement(cls, name: str):
+        """
+        Returns the named prepared statement.
+
+        The driver replaces a table's metadata object whenever it receives a schema change
+        event for it, in which case the statement is prepared again against the new schema.
+        """
+        cls.get_db_session()
+        table, _ = cls.statements[name]
+        prepared = cls.prepared_statements.get(name)
+        if prepared is not None:
+            statement, table_metadata = prepared
+            if table_metadata is cls._table_metadata(table):
+                cls.statement_stats["hits"] += 1
+                return statement
+
+        cls.statement_stats["misses"] += 1
+        logger.warning("Preparing statement '%s' on demand", name)
+        return cls._prepare(name)
+
+    @classmethod
+    def get_statement_stats(cls):
+        return {
+            **cls.statement_stats,
+            "prepared": sorted(cls.prepared_statements),
+        }
+
 
 PG_PORT = os.environ["PG_PORT"]
 PG_URI = os.environ["PG_CONN_STRING"]
 PG_PASSWORD = os.environ["PG_PASSWORD"]
 PG_CONN_STRING = f"postgres://postgres:{PG_PASSWORD}@{PG_URI}:{PG_PORT}/postgres"
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", 1))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", 8))
+PG_POOL_TIMEOUT_SECONDS = float(os.getenv("PG_POOL_TIMEOUT_SECONDS", 10))
+# Connections idle for longer are checked with a round trip before being handed out.
+PG_POOL_CHECK_IDLE_SECONDS = 30
+
+
+class RedisDb:
+    client = None
+
+    @classmethod
+    def get_client(cls) -> redis.Redis:
+        if cls.client is None:
+            cls.client = redis.Redis.from_url(REDIS_URL)
+        return cls.client
+
+
+def to_csv_field(value) -> str:
+    # An unquoted empty field is NULL to COPY, and a quoted one an empty string.
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class CsvRowStream(io.TextIOBase):
+    """
+    A file of CSV lines for `COPY ... FROM STDIN`, formatted from `rows` only as they are read.
+    """
+
+    def __init__(self, rows: Iterable[Sequence]):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self.row_count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += ",".join(to_csv_field(value) for value in row) + "\n"
+            self.row_count += 1
+        if size is None or size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+class PostgresPoolTimeout(pool.PoolError):
+    pass
 
 
 class PostgresSearchDb:
     DB_POOL = None
 
+    # Bounds checkouts to the pool's size, so that callers wait for a connection
+    # instead of the pool raising once it is exhausted.
+    _slots = None
+    # Guards creating the pool, which the first concurrent queries may race to do.
+    _pool_lock = Lock()
+    # id(connection) -> when it was last returned
+    _last_used = {}
+    _stats_lock = Lock()
+    pool_stats = {
+        "checkouts": 0,
+        "in_use": 0,
+        "timeouts": 0,
+        "discarded": 0,
+        "total_wait_ms": 0.0,
+        "max_wait_ms": 0.0,
+    }
+
     @classmethod
     def get_pool(cls):
         if cls.DB_POOL is None:
-            cls.DB_POOL = pool.ThreadedConnectionPool(
-                0,  # Min Connection
-                4,  # Max Connection (4 Threads)
-                user="postgres",
-                password=PG_PASSWORD,
-                host=PG_URI,
-                database="postgres",
-            )
+            with cls._pool_lock:
+                if cls.DB_POOL is None:
+                    # The slots are set first, so that any caller seeing the pool has them.
+                    cls._slots = BoundedSemaphore(PG_POOL_MAX)
+                    cls.DB_POOL = pool.ThreadedConnectionPool(
+                        PG_POOL_MIN,
+                        PG_POOL_MAX,
+                        user="postgres",
+                        password=PG_PASSWORD,
+                        host=PG_URI,
+                        database="postgres",
+                    )
         return cls.DB_POOL
 
+    @classmethod
+    def _record(cls, **changes):
+        with cls._stats_lock:
+            for key, change in changes.items():
+                cls.pool_stats[key] += change
+
+    @staticmethod
+    def _is_healthy(connection) -> bool:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @classmethod
+    def _checkout(cls, pg_pool):
+        """
+        Takes a connection from the pool, replacing closed ones and idle ones that fail a
+        health check, e.g. after a database restart.
+        """
+        while True:
+            connection = pg_pool.getconn()
+            now = time.monotonic()
+            idle_seconds = now - cls._last_used.get(id(connection), now)
+            if not connection.closed and (
+                idle_seconds < PG_POOL_CHECK_IDLE_SECONDS or cls._is_healthy(connection)
+            ):
+                return connection
+            cls._record(discarded=1)
+            cls._last_used.pop(id(connection), None)
+            pg_pool.putconn(connection, close=True)
+
+    @classmethod
+    @contextmanager
+    def connection(cls):
+        """
+        Yields a pooled connection, waiting up to `PG_POOL_TIMEOUT_SECONDS` for one.
+
+        The connection is always returned to the pool, with any open transaction rolled
+        back, and closed instead if it broke.
+        """
+        pg_pool = cls.get_pool()
+        start = time.perf_counter()
+        if not cls._slots.acquire(timeout=PG_POOL_TIMEOUT_SECONDS):
+            cls._record(timeouts=1)
+            raise PostgresPoolTimeout(
+                f"No Postgres connection was free within {PG_POOL_TIMEOUT_SECONDS}s"
+            )
+        wait_ms = (time.perf_counter() - start) * 1000
+        with cls._stats_lock:
+            cls.pool_stats["max_wait_ms"] = max(cls.pool_stats["max_wait_ms"], wait_ms)
+
+        try:
+            connection = cls._checkout(pg_pool)
+        except Exception:
+            cls._slots.release()
+            raise
+        cls._record(checkouts=1, in_use=1, total_wait_ms=wait_ms)
+        try:
+            yield connection
+        finally:
+            if not connection.closed:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    connection.close()
+            if connection.closed:
+                cls._record(discarded=1)
+                cls._last_used.pop(id(connection), None)
+            else:
+                cls._last_used[id(connection)] = time.monotonic()
+            pg_pool.putconn(connection, close=bool(connection.closed))
+            cls._record(in_use=-1)
+            cls._slots.release()
+
+    @classmethod
+    @contextmanager
+    def transaction(cls, cursor_factory=None):
+        """
+        Yields a cursor, committing once the block completes and rolling back if it raises.
+        """
+        with cls.connection() as connection:
+            with connection.cursor(cursor_factory=cursor_factory) as cursor:
+                yield cursor
+            connection.commit()
+
+    @classmethod
+    def get_pool_stats(cls):
+        with cls._stats_lock:
+            stats = dict(cls.pool_stats)
+        stats["size"] = PG_POOL_MAX
+        stats["utilisation"] = round(stats["in_use"] / PG_POOL_MAX, 2)
+        stats["avg_wait_ms"] = round(
+            stats["total_wait_ms"] / max(1, stats["checkouts"]), 2
+        )
+        return stats
+
     @classmethod
     def execute_query_batch(cls, query, params):
-        pool = cls.get_pool()
-        connection = pool.getconn()
-        if connection:
-            cursor = connection.cursor()
+        with cls.transaction() as cursor:
             execute_batch(cursor, query, params)
-            cursor.close()
-            connection.commit()
-            pool.putconn(connection)
-        else:
-            print("Unable to get connection")
-    
+
     @classmethod
     def execute_query(cls, query):
-        pool = cls.get_pool()
-        connection = pool.getconn()
-        if connection:
-            cursor = connection.cursor()
+        with cls.transaction() as cursor:
             cursor.execute(query)
-            cursor.close()
-            connection.commit()
-            pool.putconn(connection)
-        else:
-            print("Unable to get connection")
-    
+
+    @classmethod
+    def fetch_all(cls, query, params=None) -> List[dict]:
+        with cls.transaction(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    @staticmethod
+    def _on_conflict_update(columns: Sequence[str], key_columns: Sequence[str]):
+        return sql.SQL("ON CONFLICT ({}) DO UPDATE SET {}").format(
+            sql.SQL(", ").join(map(sql.Identifier, key_columns)),
+            sql.SQL(", ").join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column))
+                for column in columns
+                if column not in key_columns
+            ),
+        )
+
+    @classmethod
+    def upsert_rows(
+        cls,
+        table: str,
+        columns: Sequence[str],
+        key_columns: Sequence[str],
+        rows: Sequence[Sequence],
+    ):
+        """
+        Inserts `rows`, updating the rows already in `table` with the same key.
+        """
+        if not rows:
+            return
+        with cls.transaction() as cursor:
+            query = sql.SQL("INSERT INTO {} ({}) VALUES %s ").format(
+                sql.Identifier(table),
+                sql.SQL(", ").join(map(sql.Identifier, columns)),
+            ) + cls._on_conflict_update(columns, key_columns)
+            execute_values(cursor, query.as_string(cursor), rows)
+
+    @classmethod
+    def replace_partition(
+        cls,
+        table: str,
+        columns: Sequence[str],
+        partition: Dict[str, str],
+        rows: Sequence[Sequence],
+    ):
+        """
+        Replaces the rows of `table` matching every `partition` column value with `rows`,
+        in one transaction.
+        """
+        with cls.transaction() as cursor:
+            cursor.execute(
+                sql.SQL("DELETE FROM {} WHERE {}").format(
+                    sql.Identifier(table),
+                    sql.SQL(" AND ").join(
+                        sql.SQL("{} = %s").format(sql.Identifier(column))
+                        for column in partition
+                    ),
+                ),
+                list(partition.values()),
+            )
+            if rows:
+                execute_values(
+                    cursor,
+                    sql.SQL("INSERT INTO {} ({}) VALUES %s")
+                    .format(
+                        sql.Identifier(table),
+                        sql.SQL(", ").join(map(sql.Identifier, columns)),
+                    )
+                    .as_string(cursor),
+                    rows,
+                )
+
+    @classmethod
+    def replace_table(
+        cls,
+        table: str,
+        columns: Sequence[str],
+        key_columns: Sequence[str],
+        rows: Iterable[Sequence],
+    ) -> int:
+        """
+        Replaces the contents of `table` with `rows`, in one transaction.
+
+        Rows are streamed with `COPY` into a temporary staging table, which is then upserted
+        into `table` before rows missing from it are deleted. Readers see the old contents
+        until the commit, and rows that are kept are never deleted, so `ON DELETE CASCADE`
+        only reaches rows that are gone.
+
+        Returns the number of rows copied.
+        """
+        staging = sql.Identifier(f"{table}_staging")
+        target = sql.Identifier(table)
+        column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+        key_match = sql.SQL(" AND ").join(
+            sql.SQL("s.{0} = t.{0}").format(sql.Identifier(column))
+            for column in key_columns
+        )
+        stream = CsvRowStream(rows)
+
+        with cls.transaction() as cursor:
+            cursor.execute(
+                sql.SQL(
+                    "CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP"
+                ).format(staging, target)
+            )
+            cursor.copy_expert(
+                sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)")
+                .format(staging, column_list)
+                .as_string(cursor),
+                stream,
+            )
+            cursor.execute(
+                sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ").format(
+                    target, column_list, column_list, staging
+                )
+                + cls._on_conflict_update(columns, key_columns)
+            )
+            cursor.execute(
+                sql.SQL(
+                    "DELETE FROM {target} t "
+                    "WHERE NOT EXISTS (SELECT 1 FROM {staging} s WHERE {key_match})"
+                ).format(target=target, staging=staging, key_match=key_match)
+            )
+        return stream.row_count
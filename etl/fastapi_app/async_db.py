@@ -0,0 +1,154 @@
+import asyncio
+from typing import Any, AsyncIterator, List, Optional, Sequence, Tuple, Union
+
+from cassandra.cluster import ResponseFuture, ResultSet
+from cassandra.query import PreparedStatement, SimpleStatement
+from redis import asyncio as aioredis
+
+from etl.config import REDIS_URL
+from etl.database import PG_POOL_MAX, CassandraDb, PostgresSearchDb
+
+DEFAULT_FETCH_SIZE = 5000
+
+# Shared by the app's rate limits and caches.
+redis_client = aioredis.from_url(REDIS_URL)
+
+Query = Union[str, PreparedStatement]
+
+
+class AsyncCassandraDb:
+    """
+    Awaitable access to the `CassandraDb` session for the FastAPI event loop.
+
+    Queries are sent with `execute_async`, and the driver's callbacks resolve an asyncio
+    future on the loop, so a slow query no longer blocks other in-flight requests.
+    """
+
+    @staticmethod
+    def _statement(query: Query, params: Optional[Sequence], fetch_size: int):
+        if isinstance(query, PreparedStatement):
+            bound = query.bind(params or [])
+            bound.fetch_size = fetch_size
+            return bound, None
+        return SimpleStatement(query, fetch_size=fetch_size), params
+
+    @staticmethod
+    def _wait(response_future: ResponseFuture) -> "asyncio.Future[ResultSet]":
+        """
+        Resolves with the current page of `response_future`.
+
+        The driver calls back again for every page fetched, so each page gets its own future,
+        and callbacks for pages already resolved are ignored.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(_):
+            if not future.done():
+                future.set_result(response_future.result())
+
+        def set_exception(exc):
+            if not future.done():
+                future.set_exception(exc)
+
+        response_future.add_callbacks(
+            lambda _: loop.call_soon_threadsafe(set_result, None),
+            lambda exc: loop.call_soon_threadsafe(set_exception, exc),
+        )
+        return future
+
+    @classmethod
+    def _execute_async(
+        cls,
+        query: Query,
+        params: Optional[Sequence] = None,
+        fetch_size: int = DEFAULT_FETCH_SIZE,
+        paging_state: Optional[bytes] = None,
+    ) -> ResponseFuture:
+        session = CassandraDb.get_db_session()
+        statement, params = cls._statement(query, params, fetch_size)
+        return session.execute_async(statement, params, paging_state=paging_state)
+
+    @classmethod
+    async def execute_page(
+        cls,
+        query: Query,
+        params: Optional[Sequence] = None,
+        fetch_size: int = DEFAULT_FETCH_SIZE,
+        paging_state: Optional[bytes] = None,
+    ) -> Tuple[List[Any], Optional[bytes]]:
+        """
+        Returns a single page of rows, and the paging state to resume from, if any.
+        """
+        result = await cls._wait(
+            cls._execute_async(query, params, fetch_size, paging_state)
+        )
+        return result.current_rows, result.paging_state
+
+    @classmethod
+    async def iterate(
+        cls,
+        query: Query,
+        params: Optional[Sequence] = None,
+        fetch_size: int = DEFAULT_FETCH_SIZE,
+    ) -> AsyncIterator[Any]:
+        """
+        Yields every row, awaiting each page in turn.
+        """
+        response_future = cls._execute_async(query, params, fetch_size)
+        while True:
+            result = await cls._wait(response_future)
+            for row in result.current_rows:
+                yield row
+            if not response_future.has_more_pages:
+                return
+            response_future.start_fetching_next_page()
+
+    @classmethod
+    async def execute(
+        cls,
+        query: Query,
+        params: Optional[Sequence] = None,
+        fetch_size: int = DEFAULT_FETCH_SIZE,
+    ) -> List[Any]:
+        return [row async for row in cls.iterate(query, params, fetch_size)]
+
+    @classmethod
+    async def execute_one(cls, query: Query, params: Optional[Sequence] = None):
+        rows, _ = await cls.execute_page(query, params)
+        return rows[0] if rows else None
+
+
+class AsyncPostgresSearchDb:
+    """
+    Awaitable access to `PostgresSearchDb` for the FastAPI event loop.
+
+    psycopg2 blocks, so queries run in worker threads. No more queries are handed to
+    threads than the pool has connections, so that queries waiting for a connection
+    never take up the threads the rest of the app runs blocking calls in.
+    """
+
+    _slots: Optional[asyncio.Semaphore] = None
+    waiting = 0
+
+    @classmethod
+    def _get_slots(cls) -> asyncio.Semaphore:
+        if cls._slots is None:
+            cls._slots = asyncio.Semaphore(PG_POOL_MAX)
+        return cls._slots
+
+    @classmethod
+    async def fetch_all(cls, query, params=None) -> List[dict]:
+        cls.waiting += 1
+        try:
+            await cls._get_slots().acquire()
+        finally:
+            cls.waiting -= 1
+        try:
+            return await asyncio.to_thread(PostgresSearchDb.fetch_all, query, params)
+        finally:
+            cls._get_slots().release()
+
+    @classmethod
+    def get_pool_stats(cls):
+        return {**PostgresSearchDb.get_pool_stats(), "waiting": cls.waiting}
@@ -8,6 +8,8 @@ from fastapi import Depends, HTTPException, status
 
 from etl.database import CassandraDb
 
+from ..async_db import AsyncCassandraDb, redis_client
+from ..cache import TTLCache
 from .models import TokenData, User, UserInDB
 from ..dependencies import oauth2_scheme, pwd_context
 
@@ -15,6 +17,15 @@ from ..dependencies import oauth2_scheme, pwd_context
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+USER_CACHE_SIZE = 128
+USER_CACHE_TTL_SECONDS = 60
+
+# Authenticated users by username, so that token checks skip the `admin_user` lookup.
+# Entries hold (version, user), and are stale once the user's version in Redis moves on,
+# so that an invalidation on one replica reaches every other.
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+USER_VERSION_PREFIX = "user_cache:version"
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -24,16 +35,20 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-def get_user(username: str):
-    session = CassandraDb.get_db_session()
-    statement = session.prepare(
-        """
-        SELECT username, hashed_password, disabled
-        FROM admin_user
-        WHERE username = ?
-        """
-    )
-    res = session.execute(statement, [username]).one()
+CassandraDb.register_statement(
+    "admin_user.select",
+    "admin_user",
+    """
+    SELECT username, hashed_password, disabled
+    FROM admin_user
+    WHERE username = ?
+    """,
+)
+
+
+async def get_user(username: str):
+    statement = CassandraDb.get_statement("admin_user.select")
+    res = await AsyncCassandraDb.execute_one(statement, [username])
     if res is None:
         return None
     return UserInDB(
@@ -43,6 +58,37 @@ def get_user(username: str):
     )
 
 
+async def get_user_version(username: str) -> bytes:
+    return await redis_client.get(f"{USER_VERSION_PREFIX}:{username}") or b"0"
+
+
+async def cache_user(username: str, user: UserInDB):
+    user_cache.set(username, (await get_user_version(username), user))
+
+
+async def get_cached_user(username: str):
+    version = await get_user_version(username)
+    entry = user_cache.get(username)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    user = await get_user(username)
+    if user is not None:
+        user_cache.set(username, (version, user))
+    return user
+
+
+async def invalidate_cached_user(username: Union[str, None] = None):
+    """
+    Drops a user from the cache of every replica, e.g. after disabling them.
+    With no user given, only this process' cache is cleared.
+    """
+    if username is None:
+        user_cache.clear()
+        return
+    await redis_client.incr(f"{USER_VERSION_PREFIX}:{username}")
+    user_cache.delete(username)
+
+
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
     SECRET_KEY = os.getenv("SECRET_KEY")
 
@@ -56,10 +102,12 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     return encoded_jwt
 
 
-def authenticate_user(username: str, password: str):
-    user = get_user(username)
+async def authenticate_user(username: str, password: str):
+    user = await get_user(username)
     if not user:
+        user_cache.delete(username)
         return False
+    await cache_user(username, user)
     if not verify_password(password, user.hashed_password):
         return False
     return user
@@ -81,7 +129,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(username=token_data.username)
+    user = await get_cached_user(username=token_data.username)
     if user is None:
         raise credentials_exception
     return user
@@ -8,6 +8,7 @@ from .auth_helpers import (
     authenticate_user,
     create_access_token,
     get_current_active_user,
+    invalidate_cached_user,
     ACCESS_TOKEN_EXPIRE_MINUTES,
 )
 from .models import Token, User
@@ -19,7 +20,7 @@ router = APIRouter()
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ):
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -40,6 +41,18 @@ async def read_users_me(
     return current_user
 
 
+@router.post("/users/{username}/invalidate")
+async def invalidate_user(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    username: str,
+):
+    """
+    Drops the user from every replica's authentication cache, e.g. after disabling them.
+    """
+    await invalidate_cached_user(username)
+    return {"operation": f"user/invalidate/{username}", "status": "success"}
+
+
 @router.get("/users/me/items/")
 async def read_own_items(
     current_user: Annotated[User, Depends(get_current_active_user)]
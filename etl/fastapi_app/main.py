@@ -1,11 +1,21 @@
 import os
 import dotenv
-from fastapi import FastAPI
+
+# Loaded before the routers are imported, so that their modules read its settings.
+DOTENV_PATH = os.getcwd() + "/etl/fastapi_app/.env"
+dotenv.load_dotenv(DOTENV_PATH)
+
+from fastapi import FastAPI  # noqa: E402
+
+from etl.database import CassandraDb  # noqa: E402
 
 from .auth.authenticate import router as auth_router
+from .nft.data_points import router as data_points_router
 from .nft.gallop.api import router as gallop_router
 from .nft.mnemonic.api import router as mnemonic_router
 from .nft.populate_job import router as populate_router
+from .nft.rankings import router as rankings_router
+from .nft.search import router as search_router
 
 
 app = FastAPI()
@@ -14,15 +24,13 @@ app.include_router(auth_router)
 app.include_router(gallop_router, prefix="/gallop")
 app.include_router(mnemonic_router, prefix="/mnemonic")
 app.include_router(populate_router)
+app.include_router(rankings_router)
+app.include_router(data_points_router)
+app.include_router(search_router)
 
 
-# Initialise env values
-async def read_env_values():
-    DOTENV_PATH = os.getcwd() + "/etl/fastapi_app/.env"
-    dotenv.load_dotenv(DOTENV_PATH)
-
-
-# Connect to database, init env values
+# Connect to database
 @app.on_event("startup")
 async def api_init():
-    await read_env_values()
+    # Connect and prepare all registered statements before serving requests.
+    CassandraDb.get_db_session()
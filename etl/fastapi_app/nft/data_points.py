@@ -0,0 +1,242 @@
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import List, Optional
+
+from fastapi import HTTPException, Query
+from fastapi.routing import APIRouter
+
+from etl.database import CassandraDb
+
+from ..async_db import AsyncCassandraDb
+
+DEFAULT_WINDOW = timedelta(days=365)
+DEFAULT_PAGE_SIZE = 366
+MAX_PAGE_SIZE = 1000
+
+router = APIRouter()
+
+
+class DataPointMetric(Enum):
+    AVERAGE_PRICE = "average_price"
+    MAX_PRICE = "max_price"
+    MIN_PRICE = "min_price"
+    SALES_COUNT = "sales_count"
+    SALES_VOLUME = "sales_volume"
+    TOKENS_MINTED = "tokens_minted"
+    TOKENS_BURNED = "tokens_burned"
+    TOTAL_MINTED = "total_minted"
+    TOTAL_BURNED = "total_burned"
+    OWNERS_COUNT = "owners_count"
+
+
+class DataPointInterval(Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
+DATA_POINT_COLUMNS = ", ".join(metric.value for metric in DataPointMetric)
+
+CassandraDb.register_statement(
+    "data_point.range",
+    "data_point",
+    f"""
+    SELECT time_stamp, {DATA_POINT_COLUMNS}
+    FROM data_point
+    WHERE collection = ?
+      AND time_stamp >= ?
+      AND time_stamp < ?
+    """,
+)
+CassandraDb.register_statement(
+    "data_point.range_limit",
+    "data_point",
+    f"""
+    SELECT time_stamp, {DATA_POINT_COLUMNS}
+    FROM data_point
+    WHERE collection = ?
+      AND time_stamp >= ?
+      AND time_stamp < ?
+    LIMIT ?
+    """,
+)
+CassandraDb.register_statement(
+    "collection_rollup.select",
+    "collection_rollup",
+    """
+    SELECT window_days, window_start, window_end, points, sales_volume, sales_count,
+        min_price, max_price, average_price, owners_change, supply_change, updated_at
+    FROM collection_rollup
+    WHERE collection = ?
+    """,
+)
+
+
+def to_utc(time_stamp: datetime) -> datetime:
+    """
+    Converts to the naive UTC datetimes the driver reads and writes.
+    """
+    if time_stamp.tzinfo is not None:
+        time_stamp = time_stamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return time_stamp
+
+
+def format_time_stamp(time_stamp: datetime) -> str:
+    return time_stamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def to_json_value(value):
+    # Decimals are sent as strings, so that no precision is lost.
+    return str(value) if value is not None else None
+
+
+def get_bucket_start(time_stamp: datetime, interval: DataPointInterval) -> datetime:
+    day = time_stamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == DataPointInterval.WEEK:
+        return day - timedelta(days=day.weekday())
+    if interval == DataPointInterval.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def add_buckets(
+    bucket_start: datetime, interval: DataPointInterval, count: int
+) -> datetime:
+    if interval == DataPointInterval.WEEK:
+        return bucket_start + timedelta(weeks=count)
+    if interval == DataPointInterval.MONTH:
+        months = bucket_start.month - 1 + count
+        return bucket_start.replace(
+            year=bucket_start.year + months // 12, month=months % 12 + 1
+        )
+    return bucket_start + timedelta(days=count)
+
+
+def aggregate(values: list) -> dict:
+    values = [value for value in values if value is not None]
+    if not values:
+        return {"min": None, "max": None, "avg": None, "last": None}
+    return {
+        "min": to_json_value(min(values)),
+        "max": to_json_value(max(values)),
+        "avg": to_json_value(sum(values) / len(values)),
+        "last": to_json_value(values[-1]),
+    }
+
+
+def downsample(
+    rows: list, metrics: List[DataPointMetric], interval: DataPointInterval
+) -> List[dict]:
+    """
+    Aggregates each metric of time-ordered rows over `interval` buckets.
+    """
+    buckets = {}
+    for row in rows:
+        buckets.setdefault(get_bucket_start(row.time_stamp, interval), []).append(row)
+    return [
+        {
+            "time_stamp": format_time_stamp(bucket_start),
+            "count": len(bucket_rows),
+            **{
+                metric.value: aggregate(
+                    [getattr(row, metric.value) for row in bucket_rows]
+                )
+                for metric in metrics
+            },
+        }
+        for bucket_start, bucket_rows in buckets.items()
+    ]
+
+
+@router.get("/collections/{contract_address}/data_points")
+async def get_data_points(
+    contract_address: str,
+    metrics: List[DataPointMetric] = Query(list(DataPointMetric)),
+    interval: DataPointInterval = DataPointInterval.DAY,
+    from_time_stamp: Optional[datetime] = Query(None, alias="from"),
+    to_time_stamp: Optional[datetime] = Query(None, alias="to"),
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[datetime] = None,
+):
+    """
+    Returns a collection's data points in `[from, to)`, defaulting to the last year.
+
+    A `day` interval returns stored points, while `week` and `month` return each metric's
+    min, max, avg and last value per bucket. Pages hold up to `page_size` points or
+    buckets, and `next_cursor` is passed as `cursor` to fetch the next page.
+    """
+    to_time_stamp = to_utc(to_time_stamp or datetime.now(tz=timezone.utc))
+    from_time_stamp = to_utc(from_time_stamp or to_time_stamp - DEFAULT_WINDOW)
+    if from_time_stamp >= to_time_stamp:
+        raise HTTPException(status_code=400, detail="`from` must be before `to`")
+    start = max(from_time_stamp, to_utc(cursor)) if cursor else from_time_stamp
+
+    next_cursor = None
+    if interval == DataPointInterval.DAY:
+        rows = await AsyncCassandraDb.execute(
+            CassandraDb.get_statement("data_point.range_limit"),
+            [contract_address, start, to_time_stamp, page_size + 1],
+        )
+        if len(rows) > page_size:
+            next_cursor = format_time_stamp(rows[page_size].time_stamp)
+            rows = rows[:page_size]
+        points = [
+            {
+                "time_stamp": format_time_stamp(row.time_stamp),
+                **{
+                    metric.value: to_json_value(getattr(row, metric.value))
+                    for metric in metrics
+                },
+            }
+            for row in rows
+        ]
+    else:
+        end = min(
+            to_time_stamp,
+            add_buckets(get_bucket_start(start, interval), interval, page_size),
+        )
+        rows = await AsyncCassandraDb.execute(
+            CassandraDb.get_statement("data_point.range"),
+            [contract_address, start, end],
+        )
+        if end < to_time_stamp:
+            next_cursor = format_time_stamp(end)
+        points = downsample(rows, metrics, interval)
+
+    return {
+        "collection": contract_address,
+        "interval": interval.value,
+        "from": format_time_stamp(from_time_stamp),
+        "to": format_time_stamp(to_time_stamp),
+        "points": points,
+        "next_cursor": next_cursor,
+    }
+
+
+@router.get("/collections/{contract_address}/rollups")
+async def get_rollups(contract_address: str):
+    """
+    Returns a collection's precomputed 7, 30, 90 and 365-day aggregates, keyed by window.
+    """
+    rows = await AsyncCassandraDb.execute(
+        CassandraDb.get_statement("collection_rollup.select"), [contract_address]
+    )
+    return {
+        "collection": contract_address,
+        "rollups": {
+            row.window_days: {
+                "window_start": format_time_stamp(row.window_start),
+                "window_end": format_time_stamp(row.window_end),
+                "points": row.points,
+                "sales_volume": to_json_value(row.sales_volume),
+                "sales_count": row.sales_count,
+                "min_price": to_json_value(row.min_price),
+                "max_price": to_json_value(row.max_price),
+                "average_price": to_json_value(row.average_price),
+                "owners_change": row.owners_change,
+                "supply_change": row.supply_change,
+                "updated_at": format_time_stamp(row.updated_at),
+            }
+            for row in rows
+        },
+    }
@@ -3,12 +3,14 @@ from functools import lru_cache
 from typing import List
 
 from fastapi import APIRouter
-from httpx import AsyncClient
 
+from ..http_client import create_upstream_client
+from ..rate_limit import gallop_bucket
 from .gallop_types import GallopRankingPeriod, GallopRankMetric
 from .response_types import GallopTopCollectionResponse
 
-client = AsyncClient()
+# Gallop serves reads over POST, so those are retried as well.
+client = create_upstream_client(gallop_bucket, retry_methods=("GET", "POST"))
 router = APIRouter()
 
 
@@ -23,12 +25,16 @@ def get_header():
 
 # @router.get("/top_collections", response_model=GallopTopCollectionResponse)
 async def get_top_collections_gallop(
-    rank: GallopRankMetric, rank_duration: GallopRankingPeriod, num_records: int = 100
+    rank: GallopRankMetric,
+    rank_duration: GallopRankingPeriod,
+    num_records: int = 100,
+    page: int = 1,
 ) -> GallopTopCollectionResponse:
     payload = {
         "interval": rank_duration.value,
         "ranking_metric": rank.value,
         "page_size": num_records,
+        "page": page,
     }
     url = "https://api.prod.gallop.run/v1/analytics/eth/getLeaderBoard"
     header = get_header()
@@ -39,10 +45,10 @@ async def get_top_collections_gallop(
 
 
 # @router.post("/floor_price")
-async def floor_price(collection_addresses: List[str]):
+async def floor_price(collection_addresses: List[str], page: int = 1):
     assert len(collection_addresses) > 0
     url = "https://api.prod.gallop.run/v1/data/eth/getMarketplaceFloorPrice"
-    payload = {"collection_address": collection_addresses}
+    payload = {"collection_address": collection_addresses, "page": page}
     header = get_header()
 
     response = await client.post(url, headers=header, json=payload)
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from threading import Lock
+from typing import NamedTuple, Optional
+
+from httpx import AsyncBaseTransport, ByteStream, Request, Response
+
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH", "/tmp/nfetl_http_cache.sqlite3")
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+HOUR_IN_SECONDS = 60 * 60
+
+# (method, URL pattern, seconds a response is fresh for). Anything else is not cached.
+CACHE_TTLS = [
+    ("GET", re.compile(r"/collections/v1beta2/[^/]+/metadata"), 6 * HOUR_IN_SECONDS),
+    ("GET", re.compile(r"/collections/v1beta2/top/"), HOUR_IN_SECONDS),
+    ("POST", re.compile(r"/v1/analytics/eth/getLeaderBoard"), HOUR_IN_SECONDS),
+]
+
+
+class CachedResponse(NamedTuple):
+    status_code: int
+    headers: list
+    body: bytes
+    expires_at: float
+
+    @property
+    def validators(self):
+        headers = {key.lower(): value for key, value in self.headers}
+        validators = {}
+        if "etag" in headers:
+            validators["If-None-Match"] = headers["etag"]
+        if "last-modified" in headers:
+            validators["If-Modified-Since"] = headers["last-modified"]
+        return validators
+
+    def to_response(self) -> Response:
+        return Response(
+            self.status_code, headers=self.headers, stream=ByteStream(self.body)
+        )
+
+
+class ResponseStore:
+    """
+    Raw upstream responses in SQLite, evicting the least recently read above `max_bytes`.
+    """
+
+    def __init__(
+        self, path: str = HTTP_CACHE_PATH, max_bytes: int = HTTP_CACHE_MAX_BYTES
+    ):
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY,
+                status_code INTEGER,
+                headers TEXT,
+                body BLOB,
+                size INTEGER,
+                expires_at REAL,
+                accessed_at REAL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS response_accessed_at ON response (accessed_at)"
+        )
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status_code, headers, body, expires_at FROM response WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE response SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+        status_code, headers, body, expires_at = row
+        return CachedResponse(status_code, json.loads(headers), body, expires_at)
+
+    def put(self, key: str, response: CachedResponse):
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT OR REPLACE INTO response
+                    (key, status_code, headers, body, size, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    key,
+                    response.status_code,
+                    json.dumps(response.headers),
+                    response.body,
+                    len(response.body),
+                    response.expires_at,
+                    time.time(),
+                ),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def refresh(self, key: str, expires_at: float):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE response SET expires_at = ?, accessed_at = ? WHERE key = ?",
+                (expires_at, time.time(), key),
+            )
+            self._connection.commit()
+
+    def _evict(self):
+        (total,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response"
+        ).fetchone()
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+
+        evicted = []
+        for key, size in self._connection.execute(
+            "SELECT key, size FROM response ORDER BY accessed_at"
+        ):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._connection.executemany("DELETE FROM response WHERE key = ?", evicted)
+
+
+_response_store = None
+
+
+def get_response_store() -> ResponseStore:
+    """
+    Returns the store shared by every upstream client in the process.
+    """
+    global _response_store
+    if _response_store is None:
+        _response_store = ResponseStore()
+    return _response_store
+
+
+def get_ttl(request: Request) -> int:
+    for method, pattern, ttl in CACHE_TTLS:
+        if request.method == method and pattern.search(request.url.path):
+            return ttl
+    return 0
+
+
+def get_cache_key(request: Request) -> str:
+    digest = hashlib.sha256(request.content).hexdigest()
+    return f"{request.method} {request.url} {digest}"
+
+
+class CachingTransport(AsyncBaseTransport):
+    """
+    Serves fresh upstream responses from a `ResponseStore` without sending a request.
+
+    Stale responses carrying an `ETag` or `Last-Modified` are revalidated with a conditional
+    request, and kept for another TTL on a 304. Only successful responses are stored.
+    """
+
+    def __init__(
+        self, transport: AsyncBaseTransport, store: Optional[ResponseStore] = None
+    ):
+        self.transport = transport
+        self.store = store or get_response_store()
+
+    async def handle_async_request(self, request: Request) -> Response:
+        ttl = get_ttl(request)
+        if not ttl:
+            return await self.transport.handle_async_request(request)
+
+        await request.aread()
+        key = get_cache_key(request)
+        cached = await asyncio.to_thread(self.store.get, key)
+        if cached is not None:
+            if cached.expires_at > time.time():
+                return cached.to_response()
+            request.headers.update(cached.validators)
+
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 304 and cached is not None:
+            await response.aclose()
+            await asyncio.to_thread(self.store.refresh, key, time.time() + ttl)
+            return cached.to_response()
+        if response.status_code != 200:
+            return response
+
+        # Store the raw body, so that the client decodes it as it would the original.
+        try:
+            body = b"".join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        fresh = CachedResponse(
+            response.status_code,
+            [
+                [name.decode("latin-1"), value.decode("latin-1")]
+                for name, value in response.headers.raw
+            ],
+            body,
+            time.time() + ttl,
+        )
+        await asyncio.to_thread(self.store.put, key, fresh)
+        return fresh.to_response()
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Iterable
+
+from httpx import (
+    AsyncBaseTransport,
+    AsyncClient,
+    AsyncHTTPTransport,
+    Limits,
+    Request,
+    Response,
+    Timeout,
+    TransportError,
+)
+
+from .http_cache import CachingTransport
+from .rate_limit import RateLimitedTransport, TokenBucket
+
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+
+UPSTREAM_LIMITS = Limits(
+    max_connections=32, max_keepalive_connections=16, keepalive_expiry=60
+)
+# Bulk jobs queue many requests behind the rate limit, so only connecting is kept short.
+UPSTREAM_TIMEOUT = Timeout(60.0, connect=10.0)
+
+MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_MAX_DELAY_SECONDS = 10
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class HostMetrics:
+    """
+    Per-host request, retry and latency counters of every upstream client in the process.
+    """
+
+    counters = defaultdict(
+        lambda: {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "total_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+        }
+    )
+
+    @classmethod
+    def record_request(cls, host: str, latency_ms: float, error: bool = False):
+        counters = cls.counters[host]
+        counters["requests"] += 1
+        counters["errors"] += int(error)
+        counters["total_latency_ms"] += latency_ms
+        counters["max_latency_ms"] = max(counters["max_latency_ms"], latency_ms)
+
+    @classmethod
+    def record_retry(cls, host: str):
+        cls.counters[host]["retries"] += 1
+
+    @classmethod
+    def snapshot(cls):
+        return {
+            host: {
+                **counters,
+                "avg_latency_ms": round(
+                    counters["total_latency_ms"] / max(1, counters["requests"]), 2
+                ),
+            }
+            for host, counters in cls.counters.items()
+        }
+
+
+class InstrumentedTransport(AsyncBaseTransport):
+    def __init__(self, transport: AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: Request) -> Response:
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except TransportError:
+            HostMetrics.record_request(
+                request.url.host, (time.perf_counter() - start) * 1000, error=True
+            )
+            raise
+        HostMetrics.record_request(
+            request.url.host,
+            (time.perf_counter() - start) * 1000,
+            error=response.status_code >= 500,
+        )
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class RetryTransport(AsyncBaseTransport):
+    """
+    Retries idempotent requests after transport errors and 5xx responses,
+    sleeping for a jittered, exponentially growing delay in between.
+    """
+
+    def __init__(
+        self,
+        transport: AsyncBaseTransport,
+        retry_methods: Iterable[str] = IDEMPOTENT_METHODS,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.transport = transport
+        self.retry_methods = set(retry_methods)
+        self.max_attempts = max_attempts
+
+    @staticmethod
+    def get_delay(attempt: int) -> float:
+        return random.uniform(
+            0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2**attempt)
+        )
+
+    async def handle_async_request(self, request: Request) -> Response:
+        if request.method not in self.retry_methods:
+            return await self.transport.handle_async_request(request)
+
+        for attempt in range(1, self.max_attempts + 1):
+            is_last_attempt = attempt == self.max_attempts
+            try:
+                response = await self.transport.handle_async_request(request)
+            except TransportError:
+                if is_last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or is_last_attempt:
+                    return response
+                await response.aclose()
+
+            HostMetrics.record_retry(request.url.host)
+            await asyncio.sleep(self.get_delay(attempt))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def create_upstream_client(
+    bucket: TokenBucket,
+    retry_methods: Iterable[str] = IDEMPOTENT_METHODS,
+) -> AsyncClient:
+    """
+    Creates a client for an upstream analytics API, with its layers from the top:
+
+    1. Fresh cached responses are served without a request.
+    2. Idempotent requests are retried with jittered backoff.
+    3. Every attempt takes a token from the provider's shared rate limit.
+    4. Every attempt's latency is recorded per host.
+    5. Connections are pooled and kept alive, over HTTP/2 if enabled.
+
+    POST-based read APIs may pass `retry_methods` to have their POSTs retried too.
+    """
+    transport = AsyncHTTPTransport(limits=UPSTREAM_LIMITS, http2=UPSTREAM_HTTP2)
+    transport = InstrumentedTransport(transport)
+    transport = RateLimitedTransport(bucket, transport)
+    transport = RetryTransport(transport, retry_methods)
+    transport = CachingTransport(transport)
+    return AsyncClient(transport=transport, timeout=UPSTREAM_TIMEOUT)
@@ -0,0 +1,87 @@
+import asyncio
+import math
+import os
+from typing import AsyncIterator, List, TypedDict
+
+from .gallop.api import get_top_collections_gallop
+from .gallop.gallop_types import GallopRankingPeriod, GallopRankMetric
+from .mnemonic.api import get_top_collections
+from .mnemonic.mnemonic_types import (
+    MnemonicQuery__RankType,
+    MnemonicQuery__RecordsDuration,
+)
+
+# Number of top collections fetched per leaderboard.
+LEADERBOARD_DEPTH = int(os.getenv("LEADERBOARD_DEPTH", 100))
+
+MNEMONIC_PAGE_SIZE = 100
+GALLOP_PAGE_SIZE = 100
+
+
+class LeaderboardEntry(TypedDict):
+    contract_address: str
+    value: str
+
+
+async def iter_mnemonic_leaderboard(
+    rank: MnemonicQuery__RankType,
+    time_period: MnemonicQuery__RecordsDuration,
+    depth: int = LEADERBOARD_DEPTH,
+) -> AsyncIterator[List[LeaderboardEntry]]:
+    """
+    Yields the top `depth` collections page by page, in the order pages arrive.
+
+    All pages are requested at once, as offsets are known upfront.
+    """
+    pages = [
+        get_top_collections(
+            rank,
+            time_period,
+            limit=str(min(MNEMONIC_PAGE_SIZE, depth - offset)),
+            offset=str(offset),
+        )
+        for offset in range(0, depth, MNEMONIC_PAGE_SIZE)
+    ]
+    for page in asyncio.as_completed(pages):
+        top_collections = await page
+        yield [
+            {
+                "contract_address": ranking["collection"]["contractAddress"],
+                "value": ranking["metricValue"],
+            }
+            for ranking in top_collections["collections"]
+        ]
+
+
+def to_gallop_entries(top_collections) -> List[LeaderboardEntry]:
+    if top_collections.get("response") is None:
+        return []
+    return [
+        {"contract_address": ranking["collection_address"], "value": ranking["value"]}
+        for ranking in top_collections["response"]["leaderboard"]
+    ]
+
+
+async def iter_gallop_leaderboard(
+    rank: GallopRankMetric,
+    rank_duration: GallopRankingPeriod,
+    depth: int = LEADERBOARD_DEPTH,
+) -> AsyncIterator[List[LeaderboardEntry]]:
+    """
+    Yields the top `depth` collections page by page, in the order pages arrive.
+
+    The first page gives `total_pages`, after which the remaining pages are requested at once.
+    """
+    page_size = min(GALLOP_PAGE_SIZE, depth)
+    first_page = await get_top_collections_gallop(rank, rank_duration, page_size)
+    yield to_gallop_entries(first_page)
+
+    if first_page.get("response") is None:
+        return
+    last_page = min(first_page["response"]["total_pages"], math.ceil(depth / page_size))
+    pages = [
+        get_top_collections_gallop(rank, rank_duration, page_size, page=page)
+        for page in range(2, last_page + 1)
+    ]
+    for page in asyncio.as_completed(pages):
+        yield to_gallop_entries(await page)
@@ -4,8 +4,10 @@ from fastapi.routing import APIRouter
 
 from datetime import datetime, timezone
 from functools import lru_cache
-from httpx import AsyncClient
+from typing import Optional
 
+from ..http_client import create_upstream_client
+from ..rate_limit import mnemonic_bucket
 from .mnemonic_types import (
     MnemonicQuery__RankType,
     MnemonicQuery__RecordsDuration,
@@ -20,7 +22,7 @@ from .response_types import (
     MnemonicTopCollectionsResponse,
 )
 
-client = AsyncClient()
+client = create_upstream_client(mnemonic_bucket)
 
 router = APIRouter()
 
@@ -30,6 +32,15 @@ def get_header():
     return {"accept": "application/json", "X-API-Key": os.environ["MNEMONIC_API_KEY"]}
 
 
+def format_timestamp_lt(time_stamp_lt: Optional[datetime] = None):
+    """
+    Formats the exclusive upper bound of a time series query, defaulting to now.
+    """
+    if time_stamp_lt is None:
+        time_stamp_lt = datetime.now(tz=timezone.utc)
+    return time_stamp_lt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
 # @router.get("/collection_meta")
 async def get_collection_meta(contract_address: str) -> MnemonicCollectionsMetaResponse:
     url = f"https://ethereum-rest.api.mnemonichq.com/collections/v1beta2/{contract_address}/metadata?includeStats=true"
@@ -44,7 +55,7 @@ async def get_collection_meta(contract_address: str) -> MnemonicCollectionsMetaR
 async def get_top_collections(
     rank: MnemonicQuery__RankType,
     time_period: MnemonicQuery__RecordsDuration,
-    limit: str = "100",  # To be added in increments of 100
+    limit: str = "100",  # At most 100, see `leaderboard.iter_mnemonic_leaderboard`
     offset: str = "0",
 ) -> MnemonicTopCollectionsResponse:
     url = f"https://ethereum-rest.api.mnemonichq.com/collections/v1beta2/top/METRIC_{str(rank.value).upper()}/{time_period.value}"
@@ -63,12 +74,12 @@ async def get_collection_price_history(
     contract_address: str,
     time_period: MnemonicQuery__RecordsDuration,
     group_by: MnemonicQuery__DataTimeGroup = MnemonicQuery__DataTimeGroup.ONE_DAY,
-    time_stamp_lt: datetime = datetime.now(tz=timezone.utc),
+    time_stamp_lt: Optional[datetime] = None,
 ) -> MnemonicPriceSeries:
     url = f"https://ethereum-rest.api.mnemonichq.com/collections/v1beta2/{contract_address}/prices/{time_period.value}/{group_by.value}"
-    params = {"timestampLt": time_stamp_lt.strftime("%Y-%M-%dT%H:%M:%SZ")}
+    params = {"timestampLt": format_timestamp_lt(time_stamp_lt)}
     header = get_header()
-    response = await client.get(url, headers=header)
+    response = await client.get(url, params=params, headers=header)
 
     res = response.json()
     if "dataPoints" not in res:
@@ -80,12 +91,12 @@ async def get_collection_sales_volume(
     contract_address: str,
     time_period: MnemonicQuery__RecordsDuration,
     group_by: MnemonicQuery__DataTimeGroup = MnemonicQuery__DataTimeGroup.ONE_DAY,
-    time_stamp_lt: datetime = datetime.now(tz=timezone.utc),
+    time_stamp_lt: Optional[datetime] = None,
 ) -> MnemonicOwnersSeries:
     url = f"https://ethereum-rest.api.mnemonichq.com/collections/v1beta2/{contract_address}/sales_volume/{time_period.value}/{group_by.value}"
-    params = {"timestampLt": time_stamp_lt.strftime("%Y-%M-%dT%H:%M:%SZ")}
+    params = {"timestampLt": format_timestamp_lt(time_stamp_lt)}
     header = get_header()
-    response = await client.get(url, headers=header)
+    response = await client.get(url, params=params, headers=header)
 
     res = response.json()
     if "dataPoints" not in res:
@@ -97,12 +108,12 @@ async def get_collection_token_supply(
     contract_address: str,
     time_period: MnemonicQuery__RecordsDuration,
     group_by: MnemonicQuery__DataTimeGroup = MnemonicQuery__DataTimeGroup.ONE_DAY,
-    time_stamp_lt: datetime = datetime.now(tz=timezone.utc),
+    time_stamp_lt: Optional[datetime] = None,
 ) -> MnemonicTokensSeries:
     url = f"https://ethereum-rest.api.mnemonichq.com/collections/v1beta2/{contract_address}/supply/{time_period.value}/{group_by.value}"
-    params = {"timestampLt": time_stamp_lt.strftime("%Y-%M-%dT%H:%M:%SZ")}
+    params = {"timestampLt": format_timestamp_lt(time_stamp_lt)}
     header = get_header()
-    response = await client.get(url, headers=header)
+    response = await client.get(url, params=params, headers=header)
 
     res = response.json()
     if "dataPoints" not in res:
@@ -114,12 +125,12 @@ async def get_collection_owners_count(
     contract_address: str,
     time_period: MnemonicQuery__RecordsDuration,
     group_by: MnemonicQuery__DataTimeGroup = MnemonicQuery__DataTimeGroup.ONE_DAY,
-    time_stamp_lt: datetime = datetime.now(tz=timezone.utc),
+    time_stamp_lt: Optional[datetime] = None,
 ) -> MnemonicSalesVolumeSeries:
     url = f"https://ethereum-rest.api.mnemonichq.com/collections/v1beta2/{contract_address}/owners_count/{time_period.value}/{group_by.value}"
-    params = {"timestampLt": time_stamp_lt.strftime("%Y-%M-%dT%H:%M:%SZ")}
+    params = {"timestampLt": format_timestamp_lt(time_stamp_lt)}
     header = get_header()
-    response = await client.get(url, headers=header)
+    response = await client.get(url, params=params, headers=header)
 
     res = response.json()
     if "dataPoints" not in res:
@@ -1,111 +1,193 @@
-from typing import Annotated
-from aiometer import run_all
+import asyncio
+import logging
+from datetime import datetime
 from functools import partial
+from typing import Annotated, List, Optional
 from celery import Celery
-from fastapi import APIRouter, Depends
-import time
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 
+from etl import jobs
 from etl.config import BROKER_URL, CELERY_APP_NAME, REDIS_URL
 from etl.database import CassandraDb
+from etl.serialization import configure_serialization
+from etl.task_routing import configure_routing
+from ..async_db import AsyncCassandraDb, AsyncPostgresSearchDb, redis_client
 from ..auth.auth_helpers import get_current_active_user
 from ..auth.models import User
 
-from .gallop.api import floor_price, get_top_collections_gallop
+from .gallop.api import floor_price
 
 from .gallop.gallop_types import (
     GallopRankMetric,
     GallopRankingPeriod,
 )
 
-from .gallop.response_types import GallopTopCollectionResponse
-
-from .mnemonic.api import (
-    get_collection_meta,
-    get_collection_owners_count,
-    get_collection_price_history,
-    get_collection_sales_volume,
-    get_collection_token_supply,
-    get_top_collections,
-)
-
 from .mnemonic.mnemonic_types import (
     MnemonicQuery__RankType,
     MnemonicQuery__RecordsDuration,
 )
 
 from .mnemonic.response_types import (
-    MnemonicTopCollectionsResponse,
     MnemonicCollectionsMetaResponse,
+    MnemonicOwnersSeries,
+    MnemonicPriceSeries,
     MnemonicResponse__CollectionMeta__Metadata__Type,
+    MnemonicSalesVolumeSeries,
+    MnemonicTokensSeries,
 )
 
+from .http_client import HostMetrics
+from .leaderboard import iter_gallop_leaderboard, iter_mnemonic_leaderboard
+from .scheduler import RefreshScheduler
+from .watermark import RefreshWindow, get_refresh_window, get_refresh_windows
+
 
-TIME_PERIOD_IN_SECONDS = 1
-MNEMONIC_REQUESTS_PER_TIME_PERIOD = 10 # Free tier CAA 150723
-MNEMONIC_DELAY = TIME_PERIOD_IN_SECONDS / MNEMONIC_REQUESTS_PER_TIME_PERIOD
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 task_broker = Celery(CELERY_APP_NAME, broker=BROKER_URL, backend=REDIS_URL)
+configure_serialization(task_broker)
+configure_routing(task_broker)
+
+
+def get_job_callbacks(job_id: str, stage: str):
+    """
+    Callbacks counting a task towards its refresh job's progress once it finishes.
+    """
+    return {
+        "link": task_broker.signature("job_task_done", args=(job_id, stage)),
+        "link_error": task_broker.signature("job_task_failed", args=(job_id, stage)),
+    }
+
+
+async def send_job_task(
+    job_id: Optional[str], stage: str, name: str, args=(), kwargs=None
+):
+    """
+    Sends a task, counted towards a stage of the refresh job if there is one.
+    """
+    if job_id is None:
+        task_broker.send_task(name, args=args, kwargs=kwargs)
+        return
+    await jobs.task_sent(redis_client, job_id, stage)
+    task_broker.send_task(
+        name, args=args, kwargs=kwargs, **get_job_callbacks(job_id, stage)
+    )
 
 
 @router.get("/nft/refresh")
 async def refresh_collections(
     current_user: Annotated[User, Depends(get_current_active_user)],
-    num_days: str = "ONE_DAY",
+    background_tasks: BackgroundTasks,
+):
+    """
+    Starts the daily job that runs a refresh on the collections' data.
+
+    Returns the job's id at once, whose progress is read from `/nft/refresh/{job_id}`.
+    """
+    job_id = jobs.new_job_id()
+    await jobs.create(redis_client, job_id)
+    background_tasks.add_task(run_refresh_job, job_id, current_user)
+    return {"job_id": job_id}
+
+
+@router.get("/nft/refresh/{job_id}")
+async def get_refresh_job(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    job_id: str,
 ):
     """
-    The daily job that runs a refresh on the collections' data.
+    Returns a refresh job's status, and the progress of its rankings, fetches, writes,
+    floor and migrate stages.
+    """
+    fields = await jobs.get(redis_client, job_id)
+    if not fields:
+        raise HTTPException(status_code=404, detail="Refresh job not found")
+    return jobs.to_progress(job_id, fields)
+
+
+async def keep_alive(job_id: str):
+    while True:
+        await jobs.heartbeat(redis_client, job_id)
+        await asyncio.sleep(jobs.HEARTBEAT_INTERVAL_SECONDS)
+
+
+async def run_refresh_job(job_id: str, current_user: User):
+    heartbeat = asyncio.create_task(keep_alive(job_id))
+    try:
+        await refresh(job_id, current_user)
+    except Exception as e:
+        logger.exception("refresh/%s failed", job_id)
+        await jobs.update(redis_client, job_id, status=jobs.FAILED, error=repr(e))
+    finally:
+        heartbeat.cancel()
 
+
+async def refresh(job_id: str, current_user: User):
+    """
     Rankings across all metrics are updated, while metadata and time series are populated as well.
+    Time series are fetched from each collection's latest stored point, so only new points are fetched.
+
+    The search database is migrated once every write of the job is done.
     """
 
     # 1. Update rankings, and get a set of all collections referenced
     # Get all existing collections
-    existing_collections = set(get_collections(current_user))
+    existing_collections = set(await get_collections(current_user))
 
-    res = await update_collections_ranking()
+    await jobs.set_stage(redis_client, job_id, jobs.RANKINGS, jobs.RUNNING)
+    res = await update_collections_ranking(job_id)
     if res["collections"] is None:
-        return "Rankings Update failed"
-
-    existing_refresh_amount_map = {
-        "ONE_DAY": MnemonicQuery__RecordsDuration.ONE_DAY,
-        "SEVEN_DAYS": MnemonicQuery__RecordsDuration.SEVEN_DAYS,
-    }
+        raise RuntimeError("Rankings Update failed")
+    await jobs.set_stage(
+        redis_client,
+        job_id,
+        jobs.RANKINGS,
+        jobs.SENT,
+        counts={"collections": res["count"]},
+    )
 
-    # 2.1: Populate past ONE DAY of new data for existing collections
+    # 2.1: Populate new data for existing collections, from their latest stored point
     new_collections = set(res["collections"]).difference(existing_collections)
-    refresh_jobs = [
-        partial(
-            upsert_collection_data,
-            current_user,
-            collection,
-            populate_data=True,
-            duration=existing_refresh_amount_map[num_days],
-        )
-        for collection in existing_collections
-    ]
+    windows = await get_refresh_windows(existing_collections)
 
     # 2.2: Populate 365 days of fresh data for new collections
     for contract_address in new_collections:
-        refresh_jobs.append(
-            partial(
-                upsert_collection_data,
-                current_user,
-                contract_address,
-                duration=MnemonicQuery__RecordsDuration.ONE_YEAR,  # needed for new collections datapoints
-                populate_data=True,
-            )
-        )
-
-    # 2.3: Refresh metadata - Each fires off requests to Mnemonic API, so only 1 can be fired at once
-    await run_all(refresh_jobs, max_at_once=1)
+        windows[contract_address] = get_refresh_window(None)
+
+    # 2.3: Refresh metadata and data points - the calls of all collections are interleaved
+    # under the shared Mnemonic rate limit, and written as soon as each collection's arrive.
+    await jobs.set_stage(redis_client, job_id, jobs.WRITES, jobs.RUNNING)
+    await jobs.set_stage(
+        redis_client,
+        job_id,
+        jobs.FETCHES,
+        jobs.RUNNING,
+        counts={"collections": len(windows)},
+    )
+    report = await get_scheduler(job_id).run(windows)
+    await jobs.set_stage(
+        redis_client,
+        job_id,
+        jobs.FETCHES,
+        jobs.DONE,
+        counts={"succeeded": report["succeeded"], "failed": len(report["failed"])},
+    )
+    await jobs.set_stage(redis_client, job_id, jobs.WRITES, jobs.SENT)
 
     # 3: Refresh floor price
-    await get_set_floor(current_user)
-
-    task_broker.send_task("migrate")
-    # task_broker.send_task("migrate_rankings")
+    await jobs.set_stage(redis_client, job_id, jobs.FLOOR, jobs.RUNNING)
+    await send_floor_prices(await get_collections(current_user), job_id)
+    await jobs.set_stage(redis_client, job_id, jobs.FLOOR, jobs.SENT)
+
+    # 4: Migrate once every write is done. If writes are still in flight, the callback
+    # of the last one queues the migration instead.
+    if await jobs.seal(redis_client, job_id):
+        await jobs.set_stage(redis_client, job_id, jobs.MIGRATE, jobs.RUNNING)
+        task_broker.send_task(
+            "migrate_changes", **get_job_callbacks(job_id, jobs.MIGRATE)
+        )
 
 
 @router.get("/nft/populate_data")
@@ -115,98 +197,91 @@ async def populate_data(
     """
     Performs a bulk populate data points job of 365 daily points per collection for new database setup.
     """
-    existing_collections = get_collections()
-    jobs = [
-        partial(
-            upsert_collection_data,
-            collection,
-            duration=MnemonicQuery__RecordsDuration.ONE_YEAR,
-            populate_data=True,
-        )
-        for collection in existing_collections
-    ]
-    await run_all(jobs, max_at_once=1)
+    existing_collections = await get_collections(current_user)
+    await get_scheduler().run(
+        {
+            collection: RefreshWindow(MnemonicQuery__RecordsDuration.ONE_YEAR, None)
+            for collection in existing_collections
+        }
+    )
 
 
 @router.get("/collections/get")
-def get_collections(
+async def get_collections(
     current_user: Annotated[User, Depends(get_current_active_user)],
 ):
     """
     Returns all collection addresses currently in the database.
     """
-    session = CassandraDb.get_db_session()
-    res = session.execute(
-        """
-        SELECT address FROM collection
-        """
-    )
-    return [c.address for c in res]
+    return [
+        c.address
+        async for c in AsyncCassandraDb.iterate(
+            """
+            SELECT address FROM collection
+            """
+        )
+    ]
 
 
-async def update_collections_ranking():
+def new_ranking_generation() -> str:
+    """
+    Ranking generation ids are UTC timestamps, so later generations sort after earlier ones.
+    """
+    return datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+
+
+async def update_collections_ranking(job_id: Optional[str] = None):
     """
     Updates the ranking tables within the database for both Gallop and Mnemonic APIs.
     """
 
-    # 1: DELETE existing rankings
+    # 1: Write the rankings under a new generation, which replaces the active one once all
+    # of its pages are written. Readers see the previous generation until then.
     out = set()
-    task_broker.send_task("delete_rankings")
+    generation = new_ranking_generation()
+    page_count = 0
+
+    async def populate_ranking(leaderboard, rank_type: str, rank_duration: str):
+        nonlocal page_count
+        # Each page is written as soon as it arrives.
+        async for entries in leaderboard:
+            out.update(entry["contract_address"] for entry in entries)
+            await send_job_task(
+                job_id,
+                jobs.RANKINGS,
+                "create_rankings",
+                args=(entries, rank_type, rank_duration, generation),
+            )
+            page_count += 1
 
     # 2.1: Populate Mnemonic Rankings
-    # As there is a time delay in between each `create_ranking` invocation,
-    # there is no need to rate limit the `get_top_collections` call.
-    for rank in MnemonicQuery__RankType._member_map_:
-        for duration in MnemonicQuery__RecordsDuration._member_map_:
-            top_collections: MnemonicTopCollectionsResponse = await get_top_collections(
+    # All leaderboards are fetched at once, paced by the shared Mnemonic and Gallop rate limits.
+    leaderboards = [
+        populate_ranking(
+            iter_mnemonic_leaderboard(
                 MnemonicQuery__RankType[rank], MnemonicQuery__RecordsDuration[duration]
-            )
-            for ranking in top_collections["collections"]:
-                out.add(ranking["collection"]["contractAddress"])
-
-            task_broker.send_task(
-                "create_rankings",
-                args=(
-                    [
-                        {
-                            "contract_address": rank["collection"]["contractAddress"],
-                            "value": rank["metricValue"],
-                        }
-                        for rank in top_collections["collections"]
-                    ],
-                    MnemonicQuery__RankType[rank]._value_,
-                    MnemonicQuery__RecordsDuration[duration]._value_,
-                ),
-            )
-            time.sleep(MNEMONIC_DELAY)
+            ),
+            MnemonicQuery__RankType[rank]._value_,
+            MnemonicQuery__RecordsDuration[duration]._value_,
+        )
+        for rank in MnemonicQuery__RankType._member_map_
+        for duration in MnemonicQuery__RecordsDuration._member_map_
+    ]
 
     # 2.2: Gallop Rankings
-    for rank in GallopRankMetric._member_map_:
-        for duration in GallopRankingPeriod._member_map_:
-            top_collections: GallopTopCollectionResponse = (
-                await get_top_collections_gallop(
-                    GallopRankMetric[rank],
-                    GallopRankingPeriod[duration],
-                )
-            )
-            for ranking in top_collections["response"]["leaderboard"]:
-                out.add(ranking["collection_address"])
-
-            task_broker.send_task(
-                "create_rankings",
-                args=(
-                    [
-                        {
-                            "contract_address": rank["collection_address"],
-                            "value": rank["value"],
-                        }
-                        for rank in top_collections["response"]["leaderboard"]
-                    ],
-                    GallopRankMetric[rank]._value_,
-                    GallopRankingPeriod[duration]._value_,
-                ),
-            )
-            time.sleep(MNEMONIC_DELAY)
+    leaderboards += [
+        populate_ranking(
+            iter_gallop_leaderboard(
+                GallopRankMetric[rank], GallopRankingPeriod[duration]
+            ),
+            GallopRankMetric[rank]._value_,
+            GallopRankingPeriod[duration]._value_,
+        )
+        for rank in GallopRankMetric._member_map_
+        for duration in GallopRankingPeriod._member_map_
+    ]
+    await asyncio.gather(*leaderboards)
+    task_broker.send_task("seal_ranking_generation", args=(generation, page_count))
 
     return {
         "count": out.__len__(),
@@ -218,7 +293,7 @@ async def update_collections_ranking():
 async def upsert_collection_data(
     current_user: Annotated[User, Depends(get_current_active_user)],
     contract_address: str,
-    populate_data=False,
+    populate_data: bool = False,
     duration: MnemonicQuery__RecordsDuration = MnemonicQuery__RecordsDuration.ONE_DAY,
 ):
     """
@@ -229,47 +304,43 @@ async def upsert_collection_data(
     4. Token Supply
     5. Owner Movements
 
-    Runs all these requests at the Mnemonic API rate limit of 30 calls per second.
+    Runs all these requests concurrently, paced by the shared Mnemonic API rate limit.
     """
-    jobs = [
-        partial(get_collection_meta, contract_address),  # [0] - Meta
-    ]
+    return await get_scheduler().refresh_collection(
+        contract_address, duration if populate_data else None
+    )
+
 
-    if populate_data:
-        jobs += [
-            partial(
-                get_collection_price_history, contract_address, duration
-            ),  # [1] - Price History
-            partial(
-                get_collection_sales_volume, contract_address, duration
-            ),  # [2] - Sales Volume
-            partial(
-                get_collection_token_supply, contract_address, duration
-            ),  # [3] - Token Supply
-            partial(
-                get_collection_owners_count, contract_address, duration
-            ),  # [4] - Owners Count
-        ]
-
-    results = await run_all(jobs, max_per_second=MNEMONIC_REQUESTS_PER_TIME_PERIOD)
-
-    # Update metadata in database.
-    metadata = results[0]
-    await populate_collection_meta(contract_address, metadata)
-
-    # Update data points in database.
-    if populate_data:
-        _, prices, sales, tokens, owners = results
-        task_broker.send_task("update_prices", args=(contract_address, prices))
-        task_broker.send_task("update_sales", args=(contract_address, sales))
-        task_broker.send_task("update_tokens", args=(contract_address, tokens))
-        task_broker.send_task("update_owners", args=(contract_address, owners))
-
-    return results
+def get_scheduler(job_id: Optional[str] = None):
+    return RefreshScheduler(
+        on_meta=partial(populate_collection_meta, job_id=job_id),
+        on_series=partial(populate_collection_data_points, job_id=job_id),
+    )
+
+
+async def populate_collection_data_points(
+    contract_address: str,
+    prices: MnemonicPriceSeries,
+    sales: MnemonicSalesVolumeSeries,
+    tokens: MnemonicTokensSeries,
+    owners: MnemonicOwnersSeries,
+    job_id: Optional[str] = None,
+):
+    """
+    Writes the collection's four time series to the database as a single task.
+    """
+    await send_job_task(
+        job_id,
+        jobs.WRITES,
+        "upsert_data_points",
+        args=(contract_address, prices, sales, tokens, owners),
+    )
 
 
 async def populate_collection_meta(
-    contract_address: str, meta_response: MnemonicCollectionsMetaResponse
+    contract_address: str,
+    meta_response: MnemonicCollectionsMetaResponse,
+    job_id: Optional[str] = None,
 ):
     """
     Populates the collection's metadata from the Mnemonic API response.
@@ -298,7 +369,9 @@ async def populate_collection_meta(
             ext_url = meta["value"]
 
     # insert into database
-    task_broker.send_task(
+    await send_job_task(
+        job_id,
+        jobs.WRITES,
         "upsert_collection",
         args=(
             contract_address,
@@ -317,29 +390,119 @@ async def populate_collection_meta(
     )
 
 
+GALLOP_STEP_SIZE = 10  # Addresses per Gallop floor price request, as per their restriction
+GALLOP_MAX_CHUNKS_IN_FLIGHT = 8
+FLOOR_TASK_SIZE = 100  # Collections per `update_floor` task
+
+
+async def get_floor_chunk(collection_addresses: List[str]):
+    """
+    Retrieves every page of floor prices for up to `GALLOP_STEP_SIZE` collections.
+
+    Failed requests are already retried with backoff by the Gallop client, so a chunk that
+    still fails is logged and skipped.
+    """
+    try:
+        gallop_response = await floor_price(collection_addresses)
+        if gallop_response["response"] is None:
+            logger.warning(
+                "floor/%s: %s %s",
+                collection_addresses,
+                gallop_response["title"],
+                gallop_response["detail"],
+            )
+            return []
+
+        pages = await asyncio.gather(
+            *[
+                floor_price(collection_addresses, page=page)
+                for page in range(2, gallop_response["response"]["total_pages"] + 1)
+            ]
+        )
+        floor_prices = list(gallop_response["response"]["collections"])
+        for page in pages:
+            if page["response"] is not None:
+                floor_prices += page["response"]["collections"]
+        return floor_prices
+    except Exception as e:
+        logger.warning("floor/%s failed: %r", collection_addresses, e)
+        return []
+
+
 @router.get("/floor_price/set")
 async def get_set_floor(
     current_user: Annotated[User, Depends(get_current_active_user)],
 ):
     """
     Sends collection addresses to the GALLOP API in batches of 10 as per their restriction.
-    Retrieves a set of market place data floor prices, which is passed to a Celery worker to process.
+    Batches are sent concurrently, up to `GALLOP_MAX_CHUNKS_IN_FLIGHT` at once, and paced by
+    the shared Gallop rate limit.
+
+    Retrieves a set of market place data floor prices, which is passed to Celery workers to process
+    in tasks of up to `FLOOR_TASK_SIZE` collections.
     """
-    GALLOP_STEP_SIZE = 10
-    collections = get_collections(current_user)
+    await send_floor_prices(await get_collections(current_user))
 
-    for i in range(0, len(collections), GALLOP_STEP_SIZE):
-        gallop_response = await floor_price(collections[i : i + GALLOP_STEP_SIZE])
 
-        if gallop_response["response"] is None:
-            # WIP: Change to log
-            print(gallop_response["title"], gallop_response["detail"])
-            continue
+async def send_floor_prices(collections: List[str], job_id: Optional[str] = None):
+    chunks_in_flight = asyncio.Semaphore(GALLOP_MAX_CHUNKS_IN_FLIGHT)
 
-        floor_prices = gallop_response["response"]["collections"]
-        task_broker.send_task("update_floor", kwargs=({"floor_prices": floor_prices}))
+    async def get_chunk(collection_addresses: List[str]):
+        async with chunks_in_flight:
+            return await get_floor_chunk(collection_addresses)
+
+    chunks = [
+        get_chunk(collections[i : i + GALLOP_STEP_SIZE])
+        for i in range(0, len(collections), GALLOP_STEP_SIZE)
+    ]
+
+    floor_prices = []
+    for chunk in asyncio.as_completed(chunks):
+        floor_prices += await chunk
+        while len(floor_prices) >= FLOOR_TASK_SIZE:
+            await send_job_task(
+                job_id,
+                jobs.FLOOR,
+                "update_floor",
+                kwargs={
+                    "floor_prices": floor_prices[:FLOOR_TASK_SIZE],
+                    "migrate": job_id is None,
+                },
+            )
+            floor_prices = floor_prices[FLOOR_TASK_SIZE:]
+
+    if floor_prices:
+        await send_job_task(
+            job_id,
+            jobs.FLOOR,
+            "update_floor",
+            kwargs={"floor_prices": floor_prices, "migrate": job_id is None},
+        )
 
 
 @router.get("/migrate")
 async def migrate_collections(task_name: str):
     task_broker.send_task("migrate_" + task_name)
+
+
+@router.get("/upstream/metrics")
+async def get_upstream_metrics(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+):
+    """
+    Returns per-host request, error, retry and latency counters of the upstream APIs.
+    """
+    return HostMetrics.snapshot()
+
+
+@router.get("/db/metrics")
+async def get_db_metrics(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+):
+    """
+    Returns the Postgres pool's utilisation and wait times, and prepared statement hit rates.
+    """
+    return {
+        "postgres": AsyncPostgresSearchDb.get_pool_stats(),
+        "cassandra": CassandraDb.get_statement_stats(),
+    }
@@ -0,0 +1,142 @@
+import asyncio
+import os
+from typing import List, Optional
+
+import orjson
+from fastapi import HTTPException, Query, Response
+from fastapi.routing import APIRouter
+
+from etl.config import LEADERBOARD_CACHE_PREFIX, RANKING_GENERATION_KEY
+from etl.database import CassandraDb
+
+from ..async_db import AsyncCassandraDb, redis_client
+from ..cache import TTLCache
+
+LEADERBOARD_CACHE_TTL_SECONDS = int(os.getenv("LEADERBOARD_CACHE_TTL_SECONDS", 300))
+# How long a replica may keep serving the previous generation after a ranking refresh.
+ACTIVE_GENERATION_TTL_SECONDS = 5
+MAX_PAGE_SIZE = 100
+
+router = APIRouter()
+
+CassandraDb.register_statement(
+    "ranking_generation.select",
+    "ranking_generation",
+    "SELECT generation FROM ranking_generation WHERE name = 'active'",
+)
+CassandraDb.register_statement(
+    "rankings_api.select_partition",
+    "ranking",
+    """
+    SELECT collection, value
+    FROM ranking
+    WHERE rank = ?
+      AND duration = ?
+      AND generation = ?
+    """,
+)
+CassandraDb.register_statement(
+    "collection.select_summary",
+    "collection",
+    "SELECT name, image, floor FROM collection WHERE address = ?",
+)
+
+# Encoded leaderboard pages, keyed like their copy in Redis.
+page_cache = TTLCache(512, LEADERBOARD_CACHE_TTL_SECONDS)
+generation_cache = TTLCache(1, ACTIVE_GENERATION_TTL_SECONDS)
+
+
+async def get_active_generation() -> Optional[str]:
+    generation = generation_cache.get(RANKING_GENERATION_KEY)
+    if generation is not None:
+        return generation
+
+    generation = await redis_client.get(RANKING_GENERATION_KEY)
+    if generation is not None:
+        generation = generation.decode()
+    else:
+        row = await AsyncCassandraDb.execute_one(
+            CassandraDb.get_statement("ranking_generation.select")
+        )
+        generation = row.generation if row is not None else None
+
+    if generation is not None:
+        generation_cache.set(RANKING_GENERATION_KEY, generation)
+    return generation
+
+
+async def get_collection_summary(contract_address: str) -> dict:
+    row = await AsyncCassandraDb.execute_one(
+        CassandraDb.get_statement("collection.select_summary"), [contract_address]
+    )
+    if row is None:
+        return {"name": None, "image": None, "floor": None}
+    return {
+        "name": row.name,
+        "image": row.image,
+        "floor": str(row.floor) if row.floor is not None else None,
+    }
+
+
+async def read_leaderboard_page(
+    rank: str, duration: str, generation: str, page: int, page_size: int
+) -> dict:
+    rows = await AsyncCassandraDb.execute(
+        CassandraDb.get_statement("rankings_api.select_partition"),
+        [rank, duration, generation],
+    )
+    # The partition is ordered by collection, so it is ranked here.
+    rows.sort(key=lambda row: row.value, reverse=True)
+    start = (page - 1) * page_size
+    page_rows = rows[start : start + page_size]
+    summaries: List[dict] = await asyncio.gather(
+        *[get_collection_summary(row.collection) for row in page_rows]
+    )
+    return {
+        "rank": rank,
+        "duration": duration,
+        "generation": generation,
+        "page": page,
+        "page_size": page_size,
+        "total": len(rows),
+        "collections": [
+            {
+                "position": start + i + 1,
+                "contract_address": row.collection,
+                "value": str(row.value),
+                **summary,
+            }
+            for i, (row, summary) in enumerate(zip(page_rows, summaries))
+        ],
+    }
+
+
+@router.get("/rankings/{rank}/{duration}")
+async def get_leaderboard(
+    rank: str,
+    duration: str,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+):
+    """
+    Returns a page of the `(rank, duration)` leaderboard, with each collection's name, image
+    and floor.
+
+    Pages are cached in process and in Redis under the active ranking generation, so a
+    ranking refresh invalidates them once it is activated.
+    """
+    generation = await get_active_generation()
+    if generation is None:
+        raise HTTPException(status_code=404, detail="No rankings have been generated")
+
+    key = f"{LEADERBOARD_CACHE_PREFIX}:{generation}:{rank}:{duration}:{page}:{page_size}"
+    content = page_cache.get(key)
+    if content is None:
+        content = await redis_client.get(key)
+        if content is None:
+            content = orjson.dumps(
+                await read_leaderboard_page(rank, duration, generation, page, page_size)
+            )
+            await redis_client.set(key, content, ex=LEADERBOARD_CACHE_TTL_SECONDS)
+        page_cache.set(key, content)
+    return Response(content=content, media_type="application/json")
@@ -0,0 +1,127 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from httpx import AsyncBaseTransport, AsyncHTTPTransport, Request, Response
+
+from ..async_db import redis_client
+
+# Free tier CAA 150723
+MNEMONIC_REQUESTS_PER_SECOND = float(os.getenv("MNEMONIC_REQUESTS_PER_SECOND", 10))
+GALLOP_REQUESTS_PER_SECOND = float(os.getenv("GALLOP_REQUESTS_PER_SECOND", 5))
+
+DEFAULT_RETRY_AFTER_SECONDS = 1
+MAX_RATE_LIMITED_ATTEMPTS = 5
+
+# KEYS: [bucket, blocked]
+# ARGV: [tokens per second, capacity]
+# Returns the milliseconds to wait before retrying, or 0 once a token is taken.
+TOKEN_BUCKET_SCRIPT = """
+local blocked = redis.call('PTTL', KEYS[2])
+if blocked > 0 then
+    return blocked
+end
+
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated_at) * rate / 1000)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+class TokenBucket:
+    """
+    A token bucket shared through Redis by every API replica and job calling a provider.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: Optional[float] = None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.bucket_key = f"rate_limit:{name}:bucket"
+        self.blocked_key = f"rate_limit:{name}:blocked"
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self):
+        while True:
+            wait_ms = await self._script(
+                keys=[self.bucket_key, self.blocked_key],
+                args=[self.rate, self.capacity],
+            )
+            if wait_ms <= 0:
+                return
+            await asyncio.sleep(wait_ms / 1000)
+
+    async def block_for(self, seconds: float):
+        """
+        Stops every caller from taking tokens for `seconds`, e.g. after a 429 response.
+        """
+        await redis_client.set(self.blocked_key, 1, px=max(1, int(seconds * 1000)))
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    if not value:
+        return DEFAULT_RETRY_AFTER_SECONDS
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER_SECONDS
+    return max(0, (retry_at - datetime.now(tz=timezone.utc)).total_seconds())
+
+
+class RateLimitedTransport(AsyncBaseTransport):
+    """
+    Takes a token from the provider's bucket before every request.
+
+    On a 429, the whole bucket is blocked for the response's `Retry-After`
+    and the request is sent again, up to `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        bucket: TokenBucket,
+        transport: Optional[AsyncBaseTransport] = None,
+        max_attempts: int = MAX_RATE_LIMITED_ATTEMPTS,
+    ):
+        self.bucket = bucket
+        self.transport = transport or AsyncHTTPTransport()
+        self.max_attempts = max_attempts
+
+    async def handle_async_request(self, request: Request) -> Response:
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            response = await self.transport.handle_async_request(request)
+            if response.status_code != 429 or attempt == self.max_attempts:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            await response.aclose()
+            await self.bucket.block_for(retry_after)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+mnemonic_bucket = TokenBucket("mnemonic", MNEMONIC_REQUESTS_PER_SECOND)
+gallop_bucket = TokenBucket("gallop", GALLOP_REQUESTS_PER_SECOND)
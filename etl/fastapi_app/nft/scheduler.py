@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .mnemonic.api import (
+    get_collection_meta,
+    get_collection_owners_count,
+    get_collection_price_history,
+    get_collection_sales_volume,
+    get_collection_token_supply,
+)
+from .mnemonic.mnemonic_types import MnemonicQuery__RecordsDuration
+from .watermark import RefreshWindow
+
+# Enough calls in flight to keep the Mnemonic rate budget in use while others are awaited.
+MAX_CALLS_IN_FLIGHT = 32
+
+logger = logging.getLogger(__name__)
+
+OnMeta = Callable[[str, dict], Awaitable[None]]
+OnSeries = Callable[[str, dict, dict, dict, dict], Awaitable[None]]
+
+
+class RefreshScheduler:
+    """
+    Interleaves the Mnemonic calls of many collections under one bound on calls in flight.
+
+    Rather than refreshing collections one after another, every call of every collection is
+    queued at once and sent as the shared rate limit allows. Each collection's results are
+    handed to `on_meta` and `on_series` as soon as they arrive, without waiting on the others.
+    """
+
+    def __init__(
+        self,
+        on_meta: OnMeta,
+        on_series: OnSeries,
+        max_calls_in_flight: int = MAX_CALLS_IN_FLIGHT,
+    ):
+        self.on_meta = on_meta
+        self.on_series = on_series
+        self._calls = asyncio.Semaphore(max_calls_in_flight)
+
+    async def _call(self, fetch, *args):
+        async with self._calls:
+            return await fetch(*args)
+
+    async def _refresh_meta(self, contract_address: str):
+        meta = await self._call(get_collection_meta, contract_address)
+        await self.on_meta(contract_address, meta)
+        return meta
+
+    async def _refresh_series(
+        self,
+        contract_address: str,
+        duration: MnemonicQuery__RecordsDuration,
+        since: Optional[datetime] = None,
+    ):
+        series = await asyncio.gather(
+            self._call(get_collection_price_history, contract_address, duration),
+            self._call(get_collection_sales_volume, contract_address, duration),
+            self._call(get_collection_token_supply, contract_address, duration),
+            self._call(get_collection_owners_count, contract_address, duration),
+        )
+        if since is not None:
+            # Mnemonic timestamps are fixed-width UTC strings, so they compare in order.
+            since_timestamp = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+            for s in series:
+                s["dataPoints"] = [
+                    point
+                    for point in s["dataPoints"]
+                    if point["timestamp"] >= since_timestamp
+                ]
+        await self.on_series(contract_address, *series)
+        return series
+
+    async def refresh_collection(
+        self,
+        contract_address: str,
+        duration: Optional[MnemonicQuery__RecordsDuration] = None,
+        since: Optional[datetime] = None,
+    ) -> List[dict]:
+        """
+        Refreshes a collection's metadata, and its time series over `duration` if given.
+        Points before `since` are dropped, as they are already stored.
+
+        Returns `[meta]`, or `[meta, prices, sales, tokens, owners]` with time series.
+        """
+        jobs = [self._refresh_meta(contract_address)]
+        if duration is not None:
+            jobs.append(self._refresh_series(contract_address, duration, since))
+
+        results = await asyncio.gather(*jobs)
+        return [results[0]] + (list(results[1]) if duration is not None else [])
+
+    async def run(self, collections: Dict[str, Optional[RefreshWindow]]):
+        """
+        Refreshes every collection, keyed by address with the window of series to fetch.
+
+        A failing collection is logged and reported without stopping the others.
+        """
+        addresses = list(collections)
+        results = await asyncio.gather(
+            *[
+                self.refresh_collection(address, *(collections[address] or (None,)))
+                for address in addresses
+            ],
+            return_exceptions=True,
+        )
+
+        failed = {}
+        for address, result in zip(addresses, results):
+            if isinstance(result, Exception):
+                logger.warning("refresh/%s failed: %r", address, result)
+                failed[address] = repr(result)
+
+        return {
+            "count": len(addresses),
+            "succeeded": len(addresses) - len(failed),
+            "failed": failed,
+        }
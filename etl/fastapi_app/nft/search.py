@@ -0,0 +1,187 @@
+import base64
+from decimal import Decimal, InvalidOperation
+from enum import Enum
+from typing import Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, Query
+from fastapi.routing import APIRouter
+
+from ..async_db import AsyncPostgresSearchDb
+
+MAX_LIMIT = 100
+
+router = APIRouter()
+
+
+class SearchMatch(Enum):
+    PREFIX = "prefix"
+    CONTAINS = "contains"
+    FUZZY = "fuzzy"
+
+
+class SearchSort(Enum):
+    RELEVANCE = "relevance"
+    FLOOR = "floor"
+    OWNERS = "owners"
+    SALES_VOLUME = "sales_volume"
+
+
+# Every condition is served by the trigram indexes on `name` and `description`.
+MATCH_CONDITIONS = {
+    SearchMatch.PREFIX: "(name ILIKE %(pattern)s OR description ILIKE %(pattern)s)",
+    SearchMatch.CONTAINS: "(name ILIKE %(pattern)s OR description ILIKE %(pattern)s)",
+    SearchMatch.FUZZY: "(%(q)s <%% name OR %(q)s <%% description)",
+}
+
+# (sort expression, type the cursor's value is cast to). The expressions match the keyset
+# indexes on `collection`, so that pages are read from an index in order.
+# `CURSOR_PARSERS` checks a cursor's value is of its sort's type before it is cast.
+SORTS = {
+    SearchSort.RELEVANCE: (
+        "GREATEST(COALESCE(word_similarity(%(q)s, name), 0), "
+        "COALESCE(word_similarity(%(q)s, description), 0))",
+        "real",
+    ),
+    SearchSort.FLOOR: ("COALESCE(floor, -1)", "numeric"),
+    SearchSort.OWNERS: ("COALESCE(owners, -1)", "integer"),
+    SearchSort.SALES_VOLUME: ("COALESCE(sales_volume, -1)", "numeric"),
+}
+
+
+CURSOR_PARSERS = {
+    "real": float,
+    "numeric": Decimal,
+    "integer": int,
+}
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def encode_cursor(sort: SearchSort, sort_value, address: str) -> str:
+    return base64.urlsafe_b64encode(
+        orjson.dumps([sort.value, str(sort_value), address])
+    ).decode()
+
+
+def decode_cursor(cursor: str, sort: SearchSort):
+    """
+    Returns the sort value and address of a cursor made for `sort`, or a 400 if it is
+    malformed or was made for another sort.
+    """
+    try:
+        cursor_sort, sort_value, address = orjson.loads(base64.urlsafe_b64decode(cursor))
+        if cursor_sort != sort.value:
+            raise ValueError("Cursor was made for another sort")
+        if not isinstance(sort_value, str) or not isinstance(address, str):
+            raise ValueError("Cursor values must be strings")
+        CURSOR_PARSERS[SORTS[sort][1]](sort_value)
+    except (TypeError, ValueError, InvalidOperation):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return sort_value, address
+
+
+def build_search_query(
+    match: Optional[SearchMatch],
+    sort: SearchSort,
+    has_type: bool,
+    has_cursor: bool,
+) -> str:
+    sort_expression, cursor_type = SORTS[sort]
+    conditions = []
+    if match is not None:
+        conditions.append(MATCH_CONDITIONS[match])
+    if has_type:
+        conditions.append("type = %(type)s")
+    if has_cursor:
+        conditions.append(
+            f"({sort_expression}, address) < "
+            f"(%(cursor_value)s::{cursor_type}, %(cursor_address)s)"
+        )
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+        SELECT address, name, type, image, tokens, owners, sales_volume, floor,
+            {sort_expression} AS sort_value
+        FROM collection
+        {where}
+        ORDER BY {sort_expression} DESC, address DESC
+        LIMIT %(limit)s
+    """
+
+
+def build_search_params(
+    q: Optional[str],
+    match: SearchMatch,
+    type: Optional[str],
+    limit: int,
+    cursor: Optional[Tuple[str, str]] = None,
+) -> dict:
+    """
+    Returns the parameters of a query from `build_search_query`, fetching one row more
+    than `limit` to tell whether there is a next page. `cursor` is a decoded cursor.
+    """
+    params = {"type": type, "limit": limit + 1}
+    if q:
+        params["q"] = q
+        params["pattern"] = (
+            escape_like(q) + "%"
+            if match == SearchMatch.PREFIX
+            else "%" + escape_like(q) + "%"
+        )
+    if cursor is not None:
+        params["cursor_value"], params["cursor_address"] = cursor
+    return params
+
+
+def to_json_value(value):
+    return str(value) if isinstance(value, Decimal) else value
+
+
+@router.get("/collections/search")
+async def search_collections(
+    q: Optional[str] = Query(None, min_length=1, max_length=100),
+    match: SearchMatch = SearchMatch.PREFIX,
+    type: Optional[str] = None,
+    sort: Optional[SearchSort] = None,
+    limit: int = Query(20, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+):
+    """
+    Searches collections by name and description, optionally of one `type`.
+
+    `prefix` and `contains` match case-insensitively, while `fuzzy` matches misspelt
+    words by trigram similarity. Results are sorted by relevance to `q` by default, else
+    by sales volume, and `next_cursor` is passed as `cursor` to fetch the next page.
+    """
+    if sort is None:
+        sort = SearchSort.RELEVANCE if q else SearchSort.SALES_VOLUME
+    if sort == SearchSort.RELEVANCE and not q:
+        raise HTTPException(status_code=400, detail="Sorting by relevance requires `q`")
+
+    params = build_search_params(
+        q, match, type, limit, decode_cursor(cursor, sort) if cursor else None
+    )
+    query = build_search_query(
+        match if q else None, sort, type is not None, cursor is not None
+    )
+    rows = await AsyncPostgresSearchDb.fetch_all(query, params)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(
+            sort, rows[-1]["sort_value"], rows[-1]["address"]
+        )
+    return {
+        "collections": [
+            {
+                key: to_json_value(value)
+                for key, value in row.items()
+                if key != "sort_value"
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+    }
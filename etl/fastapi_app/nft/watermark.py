@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from etl.database import CassandraDb
+
+from ..async_db import AsyncCassandraDb
+from .mnemonic.mnemonic_types import MnemonicQuery__RecordsDuration
+
+MAX_LOOKUPS_IN_FLIGHT = 32
+
+# Smallest first, so the first span covering a gap is the cheapest to fetch.
+DURATION_SPANS = [
+    (MnemonicQuery__RecordsDuration.ONE_DAY, timedelta(days=1)),
+    (MnemonicQuery__RecordsDuration.SEVEN_DAYS, timedelta(days=7)),
+    (MnemonicQuery__RecordsDuration.THIRTY_DAYS, timedelta(days=30)),
+    (MnemonicQuery__RecordsDuration.ONE_YEAR, timedelta(days=365)),
+]
+
+logger = logging.getLogger(__name__)
+
+CassandraDb.register_statement(
+    "data_point.latest",
+    "data_point",
+    """
+    SELECT time_stamp
+    FROM data_point
+    WHERE collection = ?
+    ORDER BY time_stamp DESC
+    LIMIT 1
+    """,
+)
+
+
+class RefreshWindow(NamedTuple):
+    duration: MnemonicQuery__RecordsDuration
+    # Points before this are already stored. `None` when the collection has no points yet.
+    since: Optional[datetime]
+
+
+async def get_watermark(contract_address: str) -> Optional[datetime]:
+    """
+    Returns the latest `data_point.time_stamp` stored for the collection, in UTC.
+    """
+    row = await AsyncCassandraDb.execute_one(
+        CassandraDb.get_statement("data_point.latest"), [contract_address]
+    )
+    return row.time_stamp if row is not None else None
+
+
+def get_refresh_window(
+    watermark: Optional[datetime], now: Optional[datetime] = None
+) -> RefreshWindow:
+    """
+    Picks the smallest Mnemonic duration reaching back to the watermark.
+
+    The watermark's own point is fetched again, as its period may not have been complete
+    when it was stored. Collections without points get a full year.
+    """
+    if watermark is None:
+        return RefreshWindow(MnemonicQuery__RecordsDuration.ONE_YEAR, None)
+
+    gap = (now or datetime.utcnow()) - watermark
+    for duration, span in DURATION_SPANS:
+        if gap <= span:
+            return RefreshWindow(duration, watermark)
+
+    logger.warning(
+        "Gap since %s exceeds the longest duration, only the last year is backfilled",
+        watermark.isoformat(),
+    )
+    return RefreshWindow(MnemonicQuery__RecordsDuration.ONE_YEAR, watermark)
+
+
+async def get_refresh_windows(
+    contract_addresses: Iterable[str],
+) -> Dict[str, RefreshWindow]:
+    lookups = asyncio.Semaphore(MAX_LOOKUPS_IN_FLIGHT)
+    now = datetime.utcnow()
+
+    async def get_window(contract_address: str):
+        async with lookups:
+            return get_refresh_window(await get_watermark(contract_address), now)
+
+    addresses = list(contract_addresses)
+    windows = await asyncio.gather(*[get_window(address) for address in addresses])
+    return dict(zip(addresses, windows))
@@ -0,0 +1,187 @@
+"""
+Progress of refresh jobs, kept in a Redis hash per job.
+
+A job is orchestrated by the API, which fetches from the upstream APIs and sends write
+tasks to the workers. Each write task reports back through its `link`/`link_error`
+callbacks, and once the API has sealed the job and every write is done, exactly one
+callback queues the migration to the search database.
+
+Every function takes a Redis client and returns the client's result, so that the API
+awaits it with its asyncio client while the workers call it with a blocking one.
+"""
+import time
+import uuid
+
+RANKINGS = "rankings"
+FETCHES = "fetches"
+WRITES = "writes"
+FLOOR = "floor"
+MIGRATE = "migrate"
+STAGES = (RANKINGS, FETCHES, WRITES, FLOOR, MIGRATE)
+
+# Stages of tasks sent to the workers, and counted by their callbacks
+TASK_STAGES = (RANKINGS, WRITES, FLOOR)
+
+RUNNING = "running"
+SENT = "sent"
+DONE = "done"
+FAILED = "failed"
+
+# Long enough to read a job's outcome after the following day's refresh
+JOB_TTL_SECONDS = 2 * 24 * 60 * 60
+
+# The API records a heartbeat while it sends a job's writes. A job it stopped sending, e.g.
+# on a restart, is reported as failed once its heartbeat is older than `JOB_STALE_SECONDS`.
+HEARTBEAT_INTERVAL_SECONDS = 30
+JOB_STALE_SECONDS = 5 * 60
+
+KEY_PREFIX = "refresh_job"
+
+# KEYS: job. ARGV: TTL, then field and value pairs.
+UPDATE_SCRIPT = """
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+"""
+
+# KEYS: job. ARGV: stage.
+# Counted before the task is sent, so that the job is never seen without pending writes
+# while one is in flight.
+SENT_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], ARGV[1] .. ':sent', 1)
+redis.call('HINCRBY', KEYS[1], 'pending', 1)
+"""
+
+# KEYS: job. ARGV: stage, whether the task failed.
+# Returns 1 to the last write of a sealed job, so that exactly one caller migrates.
+TASK_DONE_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], ARGV[1] .. (ARGV[2] == '1' and ':failed' or ':done'), 1)
+local pending = redis.call('HINCRBY', KEYS[1], 'pending', -1)
+if pending == 0 and redis.call('HGET', KEYS[1], 'sealed') == '1' then
+    return redis.call('HSETNX', KEYS[1], 'migrate:status', 'queued')
+end
+return 0
+"""
+
+# KEYS: job.
+# Returns 1 if every write was already done, in which case no callback will migrate.
+SEAL_SCRIPT = """
+redis.call('HSET', KEYS[1], 'sealed', 1)
+if tonumber(redis.call('HGET', KEYS[1], 'pending') or '0') == 0 then
+    return redis.call('HSETNX', KEYS[1], 'migrate:status', 'queued')
+end
+return 0
+"""
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def get_key(job_id: str) -> str:
+    return f"{KEY_PREFIX}:{job_id}"
+
+
+def update(client, job_id: str, **fields):
+    fields["updated_at"] = time.time()
+    args = [value for item in fields.items() for value in item]
+    return client.eval(UPDATE_SCRIPT, 1, get_key(job_id), JOB_TTL_SECONDS, *args)
+
+
+def create(client, job_id: str):
+    now = time.time()
+    return update(
+        client,
+        job_id,
+        status=RUNNING,
+        stage=RANKINGS,
+        created_at=now,
+        heartbeat_at=now,
+    )
+
+
+def heartbeat(client, job_id: str):
+    return update(client, job_id, heartbeat_at=time.time())
+
+
+def set_stage(client, job_id: str, stage: str, status: str, **fields):
+    """
+    Sets a stage's status, and the job's current stage when the stage is started.
+    """
+    if status == RUNNING:
+        fields["stage"] = stage
+    counts = fields.pop("counts", {})
+    fields.update({f"{stage}:{key}": value for key, value in counts.items()})
+    return update(client, job_id, **{f"{stage}:status": status}, **fields)
+
+
+def task_sent(client, job_id: str, stage: str):
+    return client.eval(SENT_SCRIPT, 1, get_key(job_id), stage)
+
+
+def task_done(client, job_id: str, stage: str, failed: bool):
+    """
+    Counts a finished task, returning 1 if the job's migration should now be queued.
+    """
+    return client.eval(
+        TASK_DONE_SCRIPT, 1, get_key(job_id), stage, "1" if failed else "0"
+    )
+
+
+def seal(client, job_id: str):
+    """
+    Marks every write of the job as sent, returning 1 if its migration should be queued.
+    """
+    return client.eval(SEAL_SCRIPT, 1, get_key(job_id))
+
+
+def get(client, job_id: str):
+    return client.hgetall(get_key(job_id))
+
+
+def to_progress(job_id: str, fields: dict) -> dict:
+    """
+    Formats a job's hash into its status and the progress of each stage.
+    """
+    fields = {
+        key.decode() if isinstance(key, bytes) else key: (
+            value.decode() if isinstance(value, bytes) else value
+        )
+        for key, value in fields.items()
+    }
+
+    stages = {}
+    for stage in STAGES:
+        progress = {
+            key[len(stage) + 1 :]: int(value) if value.lstrip("-").isdigit() else value
+            for key, value in fields.items()
+            if key.startswith(stage + ":")
+        }
+        status = progress.pop("status", None)
+        if stage in TASK_STAGES:
+            for count in ("sent", "done", "failed"):
+                progress.setdefault(count, 0)
+            finished = progress["done"] + progress["failed"]
+            if status == SENT and finished >= progress["sent"]:
+                status = DONE
+        progress["status"] = status or "pending"
+        stages[stage] = progress
+
+    status, error = fields.get("status"), fields.get("error")
+    # Once sealed, the workers' callbacks finish the job instead of the API.
+    if (
+        status == RUNNING
+        and "sealed" not in fields
+        and time.time() - float(fields.get("heartbeat_at", 0)) > JOB_STALE_SECONDS
+    ):
+        status = FAILED
+        error = "The API stopped sending the job's writes, e.g. on a restart"
+
+    return {
+        "job_id": job_id,
+        "status": status,
+        "stage": fields.get("stage"),
+        "error": error,
+        "created_at": float(fields["created_at"]) if "created_at" in fields else None,
+        "updated_at": float(fields["updated_at"]) if "updated_at" in fields else None,
+        "stages": stages,
+    }
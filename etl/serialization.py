@@ -0,0 +1,118 @@
+import msgpack
+import zstandard
+from celery.signals import task_postrun, task_received
+from kombu.serialization import register
+
+from etl import claim_check
+
+SERIALIZER_NAME = "msgpack-zstd"
+CONTENT_TYPE = "application/x-nfetl-msgpack-zstd"
+
+# Marks a list of same-keyed dicts, e.g. a series' `dataPoints`, stored as one list per key.
+COLUMNS_KEY = "__columns__"
+
+ZSTD_LEVEL = 3
+
+# Prefixes the digest sent in place of a claim-checked payload. zstd frames never start so.
+CLAIM_CHECK_PREFIX = b"claim-check:"
+
+_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+
+# Claim check references of received tasks, by task id, until each task has run.
+_claims = {}
+
+
+def is_record_list(value) -> bool:
+    if len(value) < 2 or not all(isinstance(item, dict) for item in value):
+        return False
+    keys = value[0].keys()
+    return len(keys) > 0 and all(item.keys() == keys for item in value)
+
+
+def to_columns(value):
+    """
+    Encodes lists of same-keyed dicts as columns, so that keys are sent once per list.
+    """
+    if isinstance(value, dict):
+        return {key: to_columns(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if is_record_list(value):
+            keys = list(value[0])
+            return {
+                COLUMNS_KEY: keys,
+                "values": [[to_columns(item[key]) for item in value] for key in keys],
+            }
+        return [to_columns(item) for item in value]
+    return value
+
+
+def from_columns(value):
+    if isinstance(value, dict):
+        if COLUMNS_KEY in value:
+            keys = value[COLUMNS_KEY]
+            columns = [
+                [from_columns(item) for item in column] for column in value["values"]
+            ]
+            return [dict(zip(keys, row)) for row in zip(*columns)]
+        return {key: from_columns(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_columns(item) for item in value]
+    return value
+
+
+def dumps(body) -> bytes:
+    payload = _compressor.compress(msgpack.packb(to_columns(body), use_bin_type=True))
+    if len(payload) > claim_check.CLAIM_CHECK_THRESHOLD_BYTES:
+        return CLAIM_CHECK_PREFIX + claim_check.check(payload).encode()
+    return payload
+
+
+def loads(payload: bytes):
+    if payload.startswith(CLAIM_CHECK_PREFIX):
+        payload = claim_check.claim(payload[len(CLAIM_CHECK_PREFIX) :].decode())
+    return from_columns(msgpack.unpackb(_decompressor.decompress(payload), raw=False))
+
+
+def record_claim(request, **kwargs):
+    body = request.body
+    if (
+        request.content_type == CONTENT_TYPE
+        and isinstance(body, bytes)
+        and body.startswith(CLAIM_CHECK_PREFIX)
+    ):
+        _claims[request.id] = body[len(CLAIM_CHECK_PREFIX) :].decode()
+
+
+def release_claim(task_id, **kwargs):
+    reference = _claims.pop(task_id, None)
+    if reference is not None:
+        claim_check.release(reference)
+
+
+def configure_serialization(app):
+    """
+    Registers the serializer and sends the app's task messages with it.
+
+    Both the producers and the workers must be configured, as workers only accept
+    the content types listed here. Payloads above `CLAIM_CHECK_THRESHOLD_BYTES` are
+    kept in Redis, so that large backfills do not fill the broker.
+
+    A message's claim on its payload is released once its task has run, which relies on
+    the task running in the process that received it, as with the gevent pool. Otherwise
+    payloads are left to expire after `CLAIM_CHECK_TTL_SECONDS`.
+    """
+    register(
+        SERIALIZER_NAME,
+        dumps,
+        loads,
+        content_type=CONTENT_TYPE,
+        content_encoding="binary",
+    )
+    task_received.connect(record_claim, weak=False)
+    task_postrun.connect(release_claim, weak=False)
+    app.conf.update(
+        task_serializer=SERIALIZER_NAME,
+        accept_content=[SERIALIZER_NAME, "json"],
+        result_serializer="json",
+    )
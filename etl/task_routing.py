@@ -0,0 +1,60 @@
+from kombu import Queue
+
+TIMESERIES_QUEUE = "timeseries"
+METADATA_QUEUE = "metadata"
+MIGRATION_QUEUE = "migration"
+DEFAULT_QUEUE = "celery"
+
+# RabbitMQ delivers higher priorities first within a queue.
+MAX_PRIORITY = 9
+
+# Task name -> queue and priority. Heavy backfill writes are kept apart from cheap
+# metadata and floor writes, and from migrations, so that neither waits behind the other.
+TASK_ROUTES = {
+    # Time series
+    "update_rollups": {"queue": TIMESERIES_QUEUE, "priority": 6},
+    "upsert_data_points": {"queue": TIMESERIES_QUEUE, "priority": 4},
+    "update_prices": {"queue": TIMESERIES_QUEUE, "priority": 3},
+    "update_sales": {"queue": TIMESERIES_QUEUE, "priority": 3},
+    "update_tokens": {"queue": TIMESERIES_QUEUE, "priority": 3},
+    "update_owners": {"queue": TIMESERIES_QUEUE, "priority": 3},
+    # Collection metadata, floors and rankings
+    "update_floor": {"queue": METADATA_QUEUE, "priority": 8},
+    "seal_ranking_generation": {"queue": METADATA_QUEUE, "priority": 8},
+    "activate_ranking_generation": {"queue": METADATA_QUEUE, "priority": 8},
+    "job_task_done": {"queue": METADATA_QUEUE, "priority": 8},
+    "job_task_failed": {"queue": METADATA_QUEUE, "priority": 8},
+    "upsert_collection": {"queue": METADATA_QUEUE, "priority": 6},
+    "create_ranking": {"queue": METADATA_QUEUE, "priority": 5},
+    "create_rankings": {"queue": METADATA_QUEUE, "priority": 5},
+    "get_rankings": {"queue": METADATA_QUEUE, "priority": 5},
+    "delete_rankings": {"queue": METADATA_QUEUE, "priority": 3},
+    # Search index migrations
+    "migrate_changes": {"queue": MIGRATION_QUEUE, "priority": 6},
+    "migrate": {"queue": MIGRATION_QUEUE, "priority": 3},
+    "migrate_collections": {"queue": MIGRATION_QUEUE, "priority": 3},
+    "migrate_rankings": {"queue": MIGRATION_QUEUE, "priority": 3},
+}
+
+
+def configure_routing(app):
+    """
+    Declares the task queues and routes tasks to them.
+
+    Both the producers and the workers must be configured, as tasks are routed when sent.
+    Workers choose the queues they consume with `-Q`.
+    """
+    app.conf.update(
+        task_queues=[
+            Queue(
+                name,
+                routing_key=name,
+                queue_arguments={"x-max-priority": MAX_PRIORITY},
+            )
+            for name in (TIMESERIES_QUEUE, METADATA_QUEUE, MIGRATION_QUEUE)
+        ]
+        # Declared as before, since RabbitMQ rejects redeclaring a queue with new arguments.
+        + [Queue(DEFAULT_QUEUE, routing_key=DEFAULT_QUEUE)],
+        task_default_queue=DEFAULT_QUEUE,
+        task_routes=TASK_ROUTES,
+    )
@@ -0,0 +1,135 @@
+"""
+Benchmarks the collection search queries against the Postgres search database.
+
+Seeds synthetic collections if asked, then runs every query shape of the search endpoint
+and prints its latency percentiles, exiting with an error if any p99 is over budget.
+
+    python -m scripts.benchmark_search --seed 300000 --runs 500
+    python -m scripts.benchmark_search --cleanup
+
+Seeded collections have addresses starting with `0xbench`, and are only removed by
+`--cleanup`.
+"""
+import argparse
+import random
+import sys
+import time
+
+from etl.database import CsvRowStream, PostgresSearchDb
+from etl.fastapi_app.nft.search import (
+    SearchMatch,
+    SearchSort,
+    build_search_params,
+    build_search_query,
+)
+
+BENCHMARK_PREFIX = "0xbench"
+SYLLABLES = ["cry", "pto", "pun", "ks", "bo", "red", "ape", "yach", "club", "azu", "ki"]
+TYPES = ["ERC721", "ERC1155"]
+
+
+def generate_rows(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(count):
+        name = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).title()
+        yield (
+            f"{BENCHMARK_PREFIX}{i:033x}",
+            f"{name} {i}",
+            rng.choice(TYPES),
+            rng.randint(1, 20000),
+            rng.randint(1, 10000),
+            round(rng.lognormvariate(3, 2), 6),
+            "",
+            "",
+            f"The {name.lower()} collection of {rng.choice(SYLLABLES)} art",
+            None,
+            round(rng.lognormvariate(-2, 1.5), 6) if rng.random() > 0.1 else None,
+        )
+
+
+def seed(count: int):
+    with PostgresSearchDb.transaction() as cursor:
+        stream = CsvRowStream(generate_rows(count))
+        cursor.copy_expert(
+            "COPY collection (address, name, type, tokens, owners, sales_volume, image, "
+            "banner_image, description, external_url, floor) "
+            "FROM STDIN WITH (FORMAT csv)",
+            stream,
+        )
+        cursor.execute("ANALYZE collection")
+    print(f"Seeded {stream.row_count} collections")
+
+
+def cleanup():
+    with PostgresSearchDb.transaction() as cursor:
+        cursor.execute(
+            "DELETE FROM collection WHERE address LIKE %s", [BENCHMARK_PREFIX + "%"]
+        )
+        print(f"Deleted {cursor.rowcount} collections")
+
+
+def get_cases():
+    """
+    (name, query, params) of each query shape the endpoint sends.
+    """
+    cases = [
+        ("prefix/relevance", SearchMatch.PREFIX, SearchSort.RELEVANCE, "crypto", None),
+        ("contains/floor", SearchMatch.CONTAINS, SearchSort.FLOOR, "punks", None),
+        ("fuzzy/relevance", SearchMatch.FUZZY, SearchSort.RELEVANCE, "cyrpto", None),
+        ("type/sales_volume", None, SearchSort.SALES_VOLUME, None, "ERC1155"),
+        ("all/owners", None, SearchSort.OWNERS, None, None),
+    ]
+    for name, match, sort, q, type in cases:
+        query = build_search_query(match, sort, type is not None, False)
+        params = build_search_params(q, match or SearchMatch.PREFIX, type, 20)
+        yield name, query, params
+
+        # The next page, read from the cursor of the first
+        rows = PostgresSearchDb.fetch_all(query, params)
+        if len(rows) > 20:
+            query = build_search_query(match, sort, type is not None, True)
+            cursor = (str(rows[19]["sort_value"]), rows[19]["address"])
+            yield name + "/page_2", query, build_search_params(
+                q, match or SearchMatch.PREFIX, type, 20, cursor
+            )
+
+
+def percentile(latencies, p: float) -> float:
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def benchmark(runs: int, budget_ms: float) -> bool:
+    within_budget = True
+    print(f"{'query':<28}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)")
+    for name, query, params in get_cases():
+        PostgresSearchDb.fetch_all(query, params)  # Warm up the plan and cache
+        latencies = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            PostgresSearchDb.fetch_all(query, params)
+            latencies.append((time.perf_counter() - start) * 1000)
+        p99 = percentile(latencies, 0.99)
+        within_budget &= p99 <= budget_ms
+        print(
+            f"{name:<28}{percentile(latencies, 0.5):>9.2f}"
+            f"{percentile(latencies, 0.95):>9.2f}{p99:>9.2f}"
+            + ("" if p99 <= budget_ms else "  over budget")
+        )
+    return within_budget
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seed", type=int, default=0, help="collections to insert")
+    parser.add_argument("--cleanup", action="store_true", help="delete seeded rows")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--budget-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.cleanup:
+        cleanup()
+        sys.exit(0)
+    if args.seed:
+        seed(args.seed)
+    sys.exit(0 if benchmark(args.runs, args.budget_ms) else 1)
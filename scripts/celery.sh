@@ -1 +1,4 @@
-celery -A etl.celery_app.celery worker --loglevel info -P gevent -c 3
+celery -A etl.celery_app.celery worker --loglevel info -P gevent \
+    -Q ${CELERY_QUEUES:-timeseries,metadata,migration,celery} \
+    -c ${CELERY_CONCURRENCY:-3} \
+    --prefetch-multiplier ${CELERY_PREFETCH_MULTIPLIER:-1}
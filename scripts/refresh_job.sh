@@ -19,12 +19,29 @@ export TOKEN=$(curl -X 'POST' \
   -H 'Content-Type: application/x-www-form-urlencoded' \
   -d "grant_type=&username=${USER_NAME}&password=${PASSWORD}&scope=&client_id=&client_secret=" | jq -r ".access_token")
 
-curl -X 'GET' "http://${HOSTNAME}/nft/refresh" \
+export JOB_ID=$(curl -X 'GET' "http://${HOSTNAME}/nft/refresh" \
   -H 'accept: application/json' \
-  -H "Authorization: Bearer ${TOKEN}"
-
-echo "Job finished"
-sleep 120 # If job runs longer, and response times out
+  -H "Authorization: Bearer ${TOKEN}" | jq -r ".job_id")
+
+# Poll the job until its writes are done and migrated, for up to MAX_WAIT_SECONDS
+MAX_WAIT_SECONDS=${MAX_WAIT_SECONDS:-7200}
+STATUS="running"
+WAITED=0
+while [ "$STATUS" = "running" ] && [ "$WAITED" -lt "$MAX_WAIT_SECONDS" ]; do
+  sleep 15
+  WAITED=$((WAITED + 15))
+  PROGRESS=$(curl -s -X 'GET' "http://${HOSTNAME}/nft/refresh/${JOB_ID}" \
+    -H 'accept: application/json' \
+    -H "Authorization: Bearer ${TOKEN}")
+  STATUS=$(echo "$PROGRESS" | jq -r ".status")
+  echo "$PROGRESS" | jq -c '{stage, stages: (.stages | map_values({status, sent, done, failed}))}'
+done
+
+if [ "$STATUS" = "running" ]; then
+  echo "Job did not finish within ${MAX_WAIT_SECONDS}s"
+else
+  echo "Job ${STATUS}"
+fi
 
 # curl -X 'GET' \
   # "http://${HOSTNAME}/upsert_collection_data?contract_address=0xBC4CA0EdA7647A8aB7C2061c2E118A18a936f13D&duration=DURATION_1_DAY" \
@@ -0,0 +1,14 @@
+import os
+
+# `etl.database` reads its connection settings on import. No test connects to the
+# databases, so placeholders are enough where they are not set.
+for name in (
+    "ASTRA_CLIENT_ID",
+    "ASTRA_CLIENT_SECRET",
+    "ASTRA_DB_NAME",
+    "ASTRA_KEYSPACE",
+    "PG_PORT",
+    "PG_CONN_STRING",
+    "PG_PASSWORD",
+):
+    os.environ.setdefault(name, "test")
@@ -0,0 +1,67 @@
+import asyncio
+
+from etl.fastapi_app.nft import populate_job
+from etl.fastapi_app.nft.gallop.gallop_types import GallopRankingPeriod, GallopRankMetric
+from etl.fastapi_app.nft.mnemonic.mnemonic_types import (
+    MnemonicQuery__RankType,
+    MnemonicQuery__RecordsDuration,
+)
+
+LEADERBOARD_COUNT = len(MnemonicQuery__RankType) * len(
+    MnemonicQuery__RecordsDuration
+) + len(GallopRankMetric) * len(GallopRankingPeriod)
+
+
+async def iter_leaderboard(rank, duration):
+    yield [
+        {"contract_address": "0xa", "value": "1.5"},
+        {"contract_address": f"0x{rank.value}", "value": "2"},
+    ]
+
+
+def patch_refresh(monkeypatch):
+    """
+    Replaces the upstream leaderboards, the broker and the job's Redis hash, returning the
+    tasks sent and the stages counted towards the job.
+    """
+    sent, counted = [], []
+
+    def send_task(name, args=(), kwargs=None, **options):
+        sent.append((name, args, options))
+
+    async def task_sent(client, job_id, stage):
+        counted.append((job_id, stage))
+
+    monkeypatch.setattr(populate_job, "iter_mnemonic_leaderboard", iter_leaderboard)
+    monkeypatch.setattr(populate_job, "iter_gallop_leaderboard", iter_leaderboard)
+    monkeypatch.setattr(populate_job.task_broker, "send_task", send_task)
+    monkeypatch.setattr(populate_job.jobs, "task_sent", task_sent)
+    return sent, counted
+
+
+def test_update_collections_ranking(monkeypatch):
+    sent, counted = patch_refresh(monkeypatch)
+
+    result = asyncio.run(populate_job.update_collections_ranking("job"))
+
+    pages = [task for task in sent if task[0] == "create_rankings"]
+    assert len(pages) == LEADERBOARD_COUNT
+    assert counted == [("job", populate_job.jobs.RANKINGS)] * LEADERBOARD_COUNT
+    assert all("link" in options and "link_error" in options for *_, options in pages)
+
+    generation = pages[0][1][3]
+    assert all(args[3] == generation for _, args, _ in pages)
+    assert sent[-1] == ("seal_ranking_generation", (generation, LEADERBOARD_COUNT), {})
+
+    assert "0xa" in result["collections"]
+    assert result["count"] == len(result["collections"])
+
+
+def test_update_collections_ranking_without_job(monkeypatch):
+    sent, counted = patch_refresh(monkeypatch)
+
+    asyncio.run(populate_job.update_collections_ranking())
+
+    assert counted == []
+    assert all(options == {} for *_, options in sent)
+    assert len(sent) == LEADERBOARD_COUNT + 1